@@ -0,0 +1,393 @@
+"""asyncio clients for driving one or many QSR10G modems concurrently"""
+import asyncio
+import logging
+import itertools
+from typing import Any, Dict, List, Optional, Pattern, Tuple, Union
+
+from qsr_mfg import (
+    TestModeConfig,
+    parse_temperature,
+    test_mode_cmd,
+    test_packet_cmd,
+    tx_pow_cmd,
+)
+from rx_stats import parse_rx_params
+from s4_connect import S4ConnectClientConfig, batch_end, batch_payload, demux_batch
+from telnet_socket import RECV_SIZE, TelnetFilter
+from utils import DEFAULT_QSR_IP
+
+
+class AsyncS4Connect:
+    """asyncio counterpart of S4Connect for one QSR telnet session"""
+
+    def __init__(
+        self, client_config, timeout: float = 30, calstate: Optional[int] = None
+    ):
+        """
+        :param client_config: S4ConnectClientConfig fields
+        :param timeout: seconds to wait for each response; the session is
+            dropped when it expires
+        :param calstate: calstate the QSR must be in, checked on every
+            (re)connect; None skips the check
+        """
+        self.logger = logging.getLogger(__name__)
+        self.client_config = S4ConnectClientConfig(**client_config)
+        self.timeout = timeout
+        self.calstate = calstate
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.filter = TelnetFilter()
+        self.buffer = bytearray()
+        self._batch_seq = itertools.count()
+        # guards the session, including reconnects after a timeout dropped it
+        self._lock = asyncio.Lock()
+
+    async def establish_connection(self, timeout: float = 2):
+        """Establish Telnet connection to QSR
+
+        :raises RuntimeError: if the QSR is not in the required calstate
+        """
+        async with self._lock:
+            await self._connect(timeout)
+
+    async def check_for_conn(self):
+        """Establish Telnet connection to QSR if not already established"""
+        async with self._lock:
+            await self._check_for_conn()
+
+    async def _check_for_conn(self):
+        if self.writer is None:
+            await self._connect()
+
+    async def _connect(self, timeout: float = 2):
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(
+                self.client_config.hostname, self.client_config.telnet_port
+            ),
+            timeout,
+        )
+        await self.read_until(self.client_config.login_prompt.encode())
+        await self.write(f"{self.client_config.username}{self.client_config.newline}")
+        await self.read_until(self.client_config.bash_prompt.encode())
+        if self.calstate is not None and await self._get_calstate() != self.calstate:
+            self._abort()
+            raise RuntimeError(
+                f"{self.client_config.hostname} not in calstate {self.calstate}, "
+                "exiting."
+            )
+
+    async def _fill(self):
+        data = await self.reader.read(RECV_SIZE)
+        if not data:
+            raise EOFError("Telnet connection closed")
+        payload, reply = self.filter.feed(data)
+        if reply:
+            self.writer.write(reply)
+        self.buffer += payload
+
+    async def read_until(
+        self, match: Union[bytes, Pattern[bytes]], timeout: Optional[float] = None
+    ) -> bytes:
+        """Read until a token or single-line regex match, inclusive
+
+        :param timeout: seconds to wait, default self.timeout
+        :raises TimeoutError: if the match did not arrive in time; the session
+            is dropped since its output can no longer be matched to commands
+        """
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            return await asyncio.wait_for(self._read_until(match), timeout)
+        except asyncio.TimeoutError:
+            self._abort()
+            raise TimeoutError(
+                f"No response from {self.client_config.hostname} in {timeout} s"
+            ) from None
+
+    def _abort(self):
+        """Drop the connection without waiting; the next command reconnects"""
+        if self.writer is not None:
+            self.writer.transport.abort()
+        self.reader = self.writer = None
+        self.filter = TelnetFilter()
+        self.buffer.clear()
+
+    async def _read_until(self, match: Union[bytes, Pattern[bytes]]) -> bytes:
+        start = 0
+        while True:
+            if isinstance(match, bytes):
+                idx = self.buffer.find(match, start)
+                end = idx + len(match) if idx >= 0 else None
+                start = max(0, len(self.buffer) - len(match) + 1)
+            else:
+                found = match.search(self.buffer, start)
+                end = found.end() if found else None
+                start = self.buffer.rfind(b"\n") + 1
+            if end is not None:
+                data = bytes(self.buffer[:end])
+                del self.buffer[:end]
+                return data
+            await self._fill()
+
+    async def write(self, inpt: str):
+        """Write to Telnet stdin"""
+        self.writer.write(inpt.encode())
+        await self.writer.drain()
+
+    async def _batch(self, cmds: List[str]) -> List[Optional[Tuple[str, int]]]:
+        tags = [
+            self.client_config.batch_trig.format(seq=next(self._batch_seq))
+            for _ in cmds
+        ]
+        await self.write(batch_payload(cmds, tags, self.client_config.newline))
+        raw = await self.read_until(batch_end(tags, self.client_config.newline))
+        return demux_batch(raw.decode(), cmds, tags)
+
+    async def communicate_many(
+        self, cmds: List[str], max_retries: int = 5
+    ) -> List[Tuple[str, int]]:
+        """Send several commands in a single write and return their responses
+
+        :param cmds: commands to run, in order
+        :param max_retries: retries for commands that have to be re-sent
+        :return: list of (response, exit code) in the same order as cmds
+        """
+        cmds = [cmd.strip() for cmd in cmds]
+        if not cmds:
+            return []
+        async with self._lock:
+            await self._check_for_conn()
+            return await self._communicate_many(cmds, max_retries)
+
+    async def _communicate_many(
+        self, cmds: List[str], max_retries: int = 5
+    ) -> List[Tuple[str, int]]:
+        results = await self._batch(cmds)
+        for idx, cmd in enumerate(cmds):
+            for _ in range(max_retries):
+                if results[idx] is not None:
+                    break
+                self.logger.debug(f"S4 failed to parse QSR command: {cmd}")
+                results[idx] = (await self._batch([cmd]))[0]
+            if results[idx] is None:
+                results[idx] = ("", -1)
+            if results[idx][1]:
+                self.logger.error(
+                    f"QSR Command FAILED with exit code {results[idx][1]}: {cmd}"
+                )
+        return results
+
+    async def communicate_trig(self, cmd: str, max_retries: int = 5) -> Tuple[str, int]:
+        """Send command using a trigger and return response and status"""
+        return (await self.communicate_many([cmd], max_retries))[0]
+
+    async def call_qcsapi(self, command: str) -> str:
+        """Run call_qcsapi command
+
+        :param command: qcsapi command to run
+        """
+        return (await self.communicate_trig(f"call_qcsapi {command}"))[0]
+
+    async def starry_moac(self, command: str) -> str:
+        """Run starry_moac command
+
+        :param command: starry_moac command to run
+        """
+        return await self.call_qcsapi(f"run_script remote_command starry_moac {command}")
+
+    async def get_calstate(self, max_retries: int = 5):
+        """Get calstate from uboot
+
+        :param max_retries: maximum number of times to try to get valid output
+        """
+        async with self._lock:
+            await self._check_for_conn()
+            return await self._get_calstate(max_retries)
+
+    async def _get_calstate(self, max_retries: int = 5):
+        for _ in range(max_retries):
+            calstate = (
+                await self._communicate_many(["call_qcsapi get_bootcfg_param calstate"])
+            )[0][0]
+            try:
+                return int(calstate)
+            except ValueError:
+                self.logger.warning(f"Bad calstate {calstate}; Retrying...")
+        return calstate
+
+    async def exit(self):
+        """Close Telnet Session"""
+        async with self._lock:
+            if self.writer is not None:
+                self.writer.close()
+                await self.writer.wait_closed()
+                self.writer = None
+
+
+class AsyncQsrMfg:
+    """asyncio counterpart of QsrMfg; build with AsyncQsrMfg.create()"""
+
+    def __init__(
+        self,
+        qsr_hostname: str = DEFAULT_QSR_IP,
+        telnet_port: int = 23,
+        timeout: float = 30,
+    ):
+        """
+        :param timeout: seconds to wait for each command's response
+        """
+        self.logger = logging.getLogger(__name__)
+        self.hostname = qsr_hostname
+        self.qsr = AsyncS4Connect(
+            client_config={"hostname": qsr_hostname, "telnet_port": telnet_port},
+            timeout=timeout,
+            calstate=1,
+        )
+
+    @classmethod
+    async def create(
+        cls,
+        qsr_hostname: str = DEFAULT_QSR_IP,
+        telnet_port: int = 23,
+        timeout: float = 30,
+    ) -> "AsyncQsrMfg":
+        """Connect and check that the QSR is in calstate 1
+
+        The calstate is checked again whenever the session reconnects.
+        """
+        self = cls(qsr_hostname, telnet_port, timeout)
+        await self.qsr.establish_connection()
+        return self
+
+    async def get_temperature(self) -> float:
+        """Get QT7810 (RFIC) temperature in C"""
+        resp = (await self.qsr.communicate_trig("call_qcsapi get_temperature"))[0]
+        return parse_temperature(resp)
+
+    async def set_cal_modem(self, modem: int = 0):
+        """Set modem; 0 = 5 GHz, 2 = 2.4 GHz"""
+        if modem not in [0, 2]:
+            raise IOError("Select valid modem from [0, 2]")
+        return await self.qsr.communicate_trig(f"set_cal_modem {modem}")
+
+    async def set_tx_pow(self, spi_id: int = 0, power_dbm: float = 13.0):
+        """Set modem TX power; see QsrMfg.set_tx_pow"""
+        return await self.qsr.communicate_trig(tx_pow_cmd(spi_id, power_dbm))
+
+    async def set_test_mode(self, config: TestModeConfig = TestModeConfig):
+        """Set the parameters to transmit; see QsrMfg.set_test_mode"""
+        cmds = ["stop_test_packet", test_mode_cmd(config)]
+        return (await self.qsr.communicate_many(cmds))[-1]
+
+    async def send_test_packet(
+        self,
+        packet_count: int = 0,
+        bandwidth: int = 99,
+        mpdu_per_ampdu: int = 1,
+        ppdu_mode: int = 0,
+    ):
+        """Transmit packets; see QsrMfg.send_test_packet"""
+        return await self.qsr.communicate_trig(
+            test_packet_cmd(packet_count, bandwidth, mpdu_per_ampdu, ppdu_mode)
+        )
+
+    async def stop_test_packet(self):
+        """Stop transmitting packets"""
+        return await self.qsr.communicate_trig("stop_test_packet")
+
+    async def show_test_packet(self) -> dict:
+        """Parses show_test_packet; see QsrMfg.show_test_packet"""
+        cmds = ["dmesg -c", "show_test_packet 8; dmesg -c"]
+        raw_output = (await self.qsr.communicate_many(cmds))[-1][0]
+        return parse_rx_params(raw_output, self.logger)
+
+    async def exit(self):
+        """Close Telnet Session"""
+        await self.qsr.exit()
+
+
+class QsrFleet:
+    """Sends the same QsrMfg command to several modems at once
+
+    Usage:
+        async with QsrFleet(["192.168.100.25", "192.168.101.25"]) as fleet:
+            temps = await fleet.get_temperature()
+    """
+
+    def __init__(
+        self, hostnames: List[str], telnet_port: int = 23, timeout: float = 30
+    ):
+        """
+        :param hostnames: QSR addresses
+        :param telnet_port: telnet port of every QSR
+        :param timeout: seconds to wait for each command's response; a modem
+            that stops answering gets a TimeoutError instead of stalling the fleet
+        """
+        self.logger = logging.getLogger(__name__)
+        self.hostnames = list(hostnames)
+        self.telnet_port = telnet_port
+        self.timeout = timeout
+        self.modems: Dict[str, AsyncQsrMfg] = {}
+
+    async def connect(self):
+        """Connect to every modem concurrently
+
+        :raises ConnectionError: if any modem could not be set up
+        """
+        results = await asyncio.gather(
+            *(
+                AsyncQsrMfg.create(host, self.telnet_port, self.timeout)
+                for host in self.hostnames
+            ),
+            return_exceptions=True,
+        )
+        failed = []
+        for host, result in zip(self.hostnames, results):
+            if isinstance(result, BaseException):
+                self.logger.error(f"Could not set up QSR {host}: {result!r}")
+                failed.append(host)
+            else:
+                self.modems[host] = result
+        if failed:
+            await self.exit()
+            raise ConnectionError(f"Could not set up QSR(s): {', '.join(failed)}")
+
+    async def run(self, method: str, *args, **kwargs) -> Dict[str, Any]:
+        """Call an AsyncQsrMfg method on every modem and gather the results
+
+        :param method: AsyncQsrMfg method name, e.g. "get_temperature"
+        :return: {hostname: result}; failures, including TimeoutError from a
+            modem that stopped answering, are returned as the exception
+        """
+        hosts = list(self.modems)
+        results = await asyncio.gather(
+            *(getattr(self.modems[host], method)(*args, **kwargs) for host in hosts),
+            return_exceptions=True,
+        )
+        for host, result in zip(hosts, results):
+            if isinstance(result, BaseException):
+                self.logger.error(f"{method} failed on {host}: {result!r}")
+        return dict(zip(hosts, results))
+
+    async def set_test_mode(self, config: TestModeConfig = TestModeConfig):
+        """set_test_mode on every modem"""
+        return await self.run("set_test_mode", config)
+
+    async def show_test_packet(self) -> Dict[str, Any]:
+        """show_test_packet on every modem"""
+        return await self.run("show_test_packet")
+
+    async def get_temperature(self) -> Dict[str, Any]:
+        """get_temperature on every modem"""
+        return await self.run("get_temperature")
+
+    async def exit(self):
+        """Close every session"""
+        await asyncio.gather(*(modem.exit() for modem in self.modems.values()))
+        self.modems = {}
+
+    async def __aenter__(self) -> "QsrFleet":
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.exit()
@@ -0,0 +1,196 @@
+"""Concurrent readiness check of every bench endpoint
+
+Every endpoint is probed in its own thread and retried with exponential
+backoff, so bring-up takes as long as the slowest device instead of the sum of
+all of them. Instruments are only probed (TCP connect / VISA resource listing),
+not opened, so the scripts can open them afterwards as before.
+
+Usage:
+    python bench_ready.py --visa TCPIP0::10.13.23.77::INSTR \\
+        USB0::6833::2500::DM3R221300366::0::INSTR
+    check_bench(default_bench() + [visa_endpoint("TCPIP0::10.13.23.90::INSTR")])
+"""
+import time
+import socket
+import logging
+import argparse
+import threading
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+try:
+    import pyvisa as visa
+except ModuleNotFoundError:
+    print("Couldn't import pyvisa")
+
+from s4_connect import S4ConnectClientConfig
+from utils import DEFAULT_ARMADA_IP, poll_until
+
+# VXI-11 instruments (TCPIP::host::INSTR) answer on the portmapper
+VXI11_PORT = 111
+ARMADA_SSH_PORT = 22
+
+
+@dataclass
+class Endpoint:
+    """One bench device and the probe telling whether it is reachable"""
+
+    name: str
+    probe: Callable[[], bool]
+    timeout: float = 30.0  # seconds of retries before giving up
+
+
+@dataclass
+class EndpointStatus:
+    """Outcome of probing one endpoint"""
+
+    name: str
+    ready: bool
+    attempts: int
+    elapsed_s: float
+    error: Optional[str] = None
+
+
+class ReadinessReport:
+    """Status of every probed endpoint"""
+
+    def __init__(self, statuses: List[EndpointStatus], elapsed_s: float):
+        self.statuses = {status.name: status for status in statuses}
+        self.elapsed_s = elapsed_s
+
+    @property
+    def ready(self) -> bool:
+        """True if every endpoint is reachable"""
+        return all(status.ready for status in self.statuses.values())
+
+    @property
+    def failed(self) -> List[str]:
+        """Names of the unreachable endpoints"""
+        return [name for name, status in self.statuses.items() if not status.ready]
+
+    def raise_if_not_ready(self):
+        """
+        :raises ConnectionError: naming the unreachable endpoints
+        """
+        if not self.ready:
+            raise ConnectionError(f"Bench not ready: {', '.join(self.failed)}")
+
+    def __str__(self):
+        lines = [f"Bench check took {self.elapsed_s:.2f} s"]
+        for status in self.statuses.values():
+            state = "ready" if status.ready else f"NOT READY ({status.error})"
+            lines.append(
+                f"  {status.name:<40} {state} after {status.attempts} attempt(s), "
+                f"{status.elapsed_s:.2f} s"
+            )
+        return "\n".join(lines)
+
+
+def tcp_probe(host: str, port: int, connect_timeout: float = 1.0) -> Callable[[], bool]:
+    """Probe that succeeds if a TCP connection to host:port opens"""
+
+    def probe() -> bool:
+        with socket.create_connection((host, port), timeout=connect_timeout):
+            return True
+
+    return probe
+
+
+class VisaResources:
+    """Lists the USB VISA resources once per check and shares the result"""
+
+    def __init__(self, max_age_s: float = 0.5):
+        self.max_age_s = max_age_s
+        self._resources: tuple = ()
+        self._listed = float("-inf")
+        self._lock = threading.Lock()
+
+    def __contains__(self, resource: str) -> bool:
+        with self._lock:
+            if time.monotonic() - self._listed > self.max_age_s:
+                self._resources = visa.ResourceManager("@py").list_resources()
+                self._listed = time.monotonic()
+            return resource in self._resources
+
+
+def visa_endpoint(
+    resource: str, timeout: float = 30.0, usb: Optional[VisaResources] = None
+) -> Endpoint:
+    """Endpoint for a VISA resource string
+
+    TCPIP resources are probed with a TCP connect (the SOCKET port, or VXI-11
+    for INSTR); USB resources must appear in the VISA resource list.
+
+    :param resource: e.g. "TCPIP0::10.13.23.77::INSTR" or "USB0::...::INSTR"
+    :param timeout: seconds of retries
+    :param usb: shared resource list for USB probes
+    """
+    parts = resource.split("::")
+    if parts[0].upper().startswith("TCPIP"):
+        port = int(parts[2]) if parts[-1].upper() == "SOCKET" else VXI11_PORT
+        return Endpoint(resource, tcp_probe(parts[1], port), timeout)
+    if parts[0].upper().startswith("USB"):
+        usb = usb if usb is not None else VisaResources()
+        return Endpoint(resource, lambda: resource in usb, timeout)
+    raise IOError(f"Unsupported VISA resource: {resource}")
+
+
+def default_bench(timeout: float = 30.0) -> List[Endpoint]:
+    """QSR telnet port and the Armada host"""
+    qsr = S4ConnectClientConfig()
+    return [
+        Endpoint(
+            f"QSR {qsr.hostname}:{qsr.telnet_port}",
+            tcp_probe(qsr.hostname, qsr.telnet_port),
+            timeout,
+        ),
+        Endpoint(
+            f"Armada {DEFAULT_ARMADA_IP}",
+            tcp_probe(DEFAULT_ARMADA_IP, ARMADA_SSH_PORT),
+            timeout,
+        ),
+    ]
+
+
+def check_bench(endpoints: List[Endpoint]) -> ReadinessReport:
+    """Probe every endpoint concurrently, retrying each until its timeout"""
+    logger = logging.getLogger(__name__)
+
+    def check(endpoint: Endpoint) -> EndpointStatus:
+        start = time.monotonic()
+        ready, attempts, error = poll_until(endpoint.probe, endpoint.timeout)
+        status = EndpointStatus(
+            endpoint.name, ready, attempts, time.monotonic() - start, error
+        )
+        logger.debug(f"{endpoint.name}: ready={ready} after {attempts} attempt(s)")
+        return status
+
+    if not endpoints:
+        return ReadinessReport([], 0.0)
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=len(endpoints)) as pool:
+        statuses = list(pool.map(check, endpoints))
+    return ReadinessReport(statuses, time.monotonic() - start)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--visa", nargs="*", default=[], help="VISA resources")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    usb = VisaResources()
+    endpoints = default_bench(args.timeout) + [
+        visa_endpoint(resource, args.timeout, usb) for resource in args.visa
+    ]
+    report = check_bench(endpoints)
+    print(report)
+    report.raise_if_not_ready()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Benchmark the show_test_packet parsers on synthetic dmesg captures
+
+Usage:
+    python bench_rx_stats.py --noise-lines 2000 --blocks 1 --repeat 200
+"""
+import re
+import time
+import random
+import logging
+import argparse
+
+from qsr_sim import QsrSimConfig, QsrSimState
+from rx_stats import SEARCH_PARAMS, parse_rx_params, parse_rx_stats
+
+
+def synthetic_dmesg(noise_lines: int, blocks: int, seed: int = 0) -> str:
+    """Kernel log with noise_lines of driver chatter around blocks dumps"""
+    rng = random.Random(seed)
+    state = QsrSimState(QsrSimConfig(seed=seed))
+    lines = [
+        f"qdrv: vap {rng.randint(0, 7)} beacon tx {rng.randint(0, 10**6)} "
+        f"tsf {rng.getrandbits(48):x}"
+        for _ in range(noise_lines)
+    ]
+    for _ in range(blocks):
+        idx = rng.randint(0, len(lines))
+        lines[idx:idx] = state.rx_stats_block()
+    return "".join(
+        f"[{idx * 0.001:12.6f}] {line}\n" for idx, line in enumerate(lines)
+    )
+
+
+def legacy_parse(raw_output: str) -> dict:
+    """The seven-search parser show_test_packet used before rx_stats"""
+    rx_params = {}
+    match_rx = re.search(SEARCH_PARAMS["packets"], raw_output)
+    match_evm = re.search(SEARCH_PARAMS["evm"], raw_output)
+    match_rssi = re.search(SEARCH_PARAMS["rssi"], raw_output)
+    match_rate = re.search(SEARCH_PARAMS["rate"], raw_output)
+    match_ru = re.search(SEARCH_PARAMS["ru"], raw_output)
+    match_he = re.search(SEARCH_PARAMS["he_ltf"], raw_output)
+    match_gain = re.search(SEARCH_PARAMS["gain"], raw_output)
+    rx_params["rf_rx"] = [int(match_rx.group(i)) for i in [1, 2]]
+    rx_params["evm"] = [float(match_evm.group(i)) for i in range(1, 5)]
+    rx_params["rssi"] = [float(match_rssi.group(i)) for i in range(1, 9)]
+    for key, value in match_rate.groupdict().items():
+        if key == "bandwidth":
+            rx_params[key] = 20 * (2 ** int(value))
+        else:
+            rx_params[key] = int(value)
+    for match in (match_ru, match_he, match_gain):
+        for key, value in match.groupdict().items():
+            rx_params[key] = int(value)
+    return rx_params
+
+
+def time_call(func, raw_output: str, repeat: int) -> float:
+    """Mean time per call in us"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(raw_output)
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--noise-lines", type=int, default=2000)
+    parser.add_argument("--blocks", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logger = logging.getLogger(__name__)
+    raw_output = synthetic_dmesg(args.noise_lines, args.blocks, args.seed)
+    if legacy_parse(raw_output) != parse_rx_params(raw_output, logger):
+        raise RuntimeError("Parsers disagree on the synthetic capture")
+    results = {
+        "legacy (7 x re.search)": time_call(legacy_parse, raw_output, args.repeat),
+        "parse_rx_params": time_call(
+            lambda raw: parse_rx_params(raw, logger), raw_output, args.repeat
+        ),
+        "parse_rx_stats": time_call(parse_rx_stats, raw_output, args.repeat),
+    }
+    print(
+        f"{len(raw_output) / 1e3:.1f} kB, {args.noise_lines} noise lines, "
+        f"{args.blocks} dump(s), {args.repeat} runs"
+    )
+    baseline = results["legacy (7 x re.search)"]
+    for name, usec in results.items():
+        print(f"{name:24} {usec:10.1f} us  x{baseline / usec:5.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""Background reader of the QSR kernel log that publishes RX statistics
+
+A dedicated telnet session runs cat /proc/kmsg; every show_test_packet dump
+that appears in the kernel log is parsed and handed to subscribers, whichever
+session asked for it. Nothing is cleared with dmesg -c and no message logged
+between polls is lost.
+"""
+import time
+import socket
+import atexit
+import logging
+import threading
+from collections import deque
+from dataclasses import asdict
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from rx_stats import (
+    KMSG_PREFIX_RE,
+    RX_BLOCK_END,
+    RX_BLOCK_START,
+    RxStats,
+    parse_rx_stats,
+)
+from s4_connect import S4Connect, S4ConnectClientConfig
+
+
+class RxBlockParser:
+    """Assembles show_test_packet dumps from kernel log lines"""
+
+    def __init__(self):
+        self.lines: Optional[List[str]] = None
+        self.timestamp: Optional[float] = None
+
+    def feed(self, line: str) -> Optional[Tuple[Optional[float], RxStats]]:
+        """Add one kernel log line
+
+        :return: (kernel timestamp, RxStats) when the line ends a dump
+        """
+        prefix = KMSG_PREFIX_RE.match(line)
+        text = line[prefix.end() :]
+        if text.startswith(RX_BLOCK_START):
+            self.lines = []
+            self.timestamp = float(prefix.group(1)) if prefix.group(1) else None
+        if self.lines is None:
+            return None
+        self.lines.append(text)
+        if not text.startswith(RX_BLOCK_END):
+            return None
+        raw_output = "\n".join(self.lines)
+        self.lines = None
+        return self.timestamp, parse_rx_stats(raw_output)
+
+
+class KmsgMonitor:
+    """Tails the QSR kernel log on its own session in a background thread
+
+    Usage:
+        monitor = KmsgMonitor({"hostname": "192.168.100.25"}).start()
+        monitor.subscribe(lambda seq, timestamp, stats: print(stats.per))
+    """
+
+    def __init__(
+        self,
+        client_config: dict,
+        server_config: Optional[dict] = None,
+        history: int = 64,
+        reconnect_s: float = 1.0,
+    ):
+        """
+        :param client_config: S4ConnectClientConfig fields
+        :param server_config: S4ConnectServerConfig fields
+        :param history: number of parsed dumps kept for wait_next()
+        :param reconnect_s: pause before reopening a dropped session
+        """
+        self.logger = logging.getLogger(__name__)
+        self.qsr = S4Connect(client_config, server_config)
+        self.reconnect_s = reconnect_s
+        self.blocks: Deque[Tuple[int, Optional[float], RxStats]] = deque(maxlen=history)
+        self.seq = 0
+        self._subscribers: List[Callable[[int, Optional[float], RxStats], None]] = []
+        self._cond = threading.Condition()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        """True while the reader thread is alive"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> "KmsgMonitor":
+        """Open the session and start tailing the kernel log"""
+        if not self.running:
+            self._stopping.clear()
+            self.qsr.check_for_conn()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 2):
+        """Stop the reader and close its session"""
+        self._stopping.set()
+        conn = self.qsr.conn
+        if conn is not None:
+            # wakes the reader, which is blocked on the socket
+            try:
+                conn.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.qsr.exit()
+        self.qsr.conn = None
+
+    def subscribe(
+        self, callback: Callable[[int, Optional[float], RxStats], None]
+    ) -> Callable[[int, Optional[float], RxStats], None]:
+        """Call callback(seq, kernel timestamp, stats) for every new dump
+
+        Callbacks run on the reader thread and should return quickly.
+        """
+        with self._cond:
+            self._subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback: Callable[[int, Optional[float], RxStats], None]):
+        """Stop calling callback"""
+        with self._cond:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def latest(self) -> Optional[RxStats]:
+        """Newest dump, None if there is none yet"""
+        with self._cond:
+            return self.blocks[-1][2] if self.blocks else None
+
+    def wait_next(
+        self, after: int, timeout: Optional[float] = None
+    ) -> Optional[RxStats]:
+        """Wait for the first dump published after sequence number after
+
+        :param after: value of seq before the dump was requested
+        :param timeout: seconds to wait, None waits forever
+        :return: the dump, None on timeout
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.seq > after, timeout):
+                return None
+            for seq, _, stats in self.blocks:
+                if seq > after:
+                    return stats
+            return self.blocks[-1][2]
+
+    def _publish(self, timestamp: Optional[float], stats: RxStats):
+        with self._cond:
+            self.seq += 1
+            seq = self.seq
+            self.blocks.append((seq, timestamp, stats))
+            subscribers = list(self._subscribers)
+            self._cond.notify_all()
+        for callback in subscribers:
+            try:
+                callback(seq, timestamp, stats)
+            except Exception:  # pylint: disable=broad-except
+                self.logger.exception("Kernel log subscriber failed")
+
+    def _run(self):
+        parser = RxBlockParser()
+        while not self._stopping.is_set():
+            try:
+                for line in self.qsr.stream("cat /proc/kmsg"):
+                    block = parser.feed(line)
+                    if block is not None:
+                        self._publish(*block)
+            except (EOFError, OSError) as err:
+                if self._stopping.is_set():
+                    return
+                self.logger.warning(f"Kernel log session dropped ({err}); reopening")
+                self.qsr.conn = None
+                time.sleep(self.reconnect_s)
+
+
+_MONITORS: Dict[Tuple[str, int], KmsgMonitor] = {}
+_USERS: Dict[Tuple[str, int], int] = {}
+_MONITORS_LOCK = threading.Lock()
+
+
+def get_kmsg_monitor(
+    client_config: S4ConnectClientConfig, server_config: Optional[dict] = None
+) -> KmsgMonitor:
+    """Return the running monitor for a QSR, starting it if needed
+
+    /proc/kmsg hands each message to one reader only, so there is a single
+    monitor per QSR in the process, shared by every caller. Each call must be
+    paired with release_kmsg_monitor().
+    """
+    key = (client_config.hostname, client_config.telnet_port)
+    with _MONITORS_LOCK:
+        monitor = _MONITORS.get(key)
+        if monitor is None:
+            monitor = KmsgMonitor(asdict(client_config), server_config)
+            _MONITORS[key] = monitor
+        _USERS[key] = _USERS.get(key, 0) + 1
+        return monitor.start()
+
+
+def release_kmsg_monitor(monitor: KmsgMonitor):
+    """Drop one use of a monitor from get_kmsg_monitor(); the last stops it"""
+    with _MONITORS_LOCK:
+        for key, shared in _MONITORS.items():
+            if shared is monitor:
+                break
+        else:
+            return
+        _USERS[key] -= 1
+        if _USERS[key] <= 0:
+            monitor.stop()
+            del _MONITORS[key], _USERS[key]
+
+
+def stop_kmsg_monitors():
+    """Stop every monitor started with get_kmsg_monitor()"""
+    with _MONITORS_LOCK:
+        for monitor in _MONITORS.values():
+            monitor.stop()
+        _MONITORS.clear()
+        _USERS.clear()
+
+
+atexit.register(stop_kmsg_monitors)
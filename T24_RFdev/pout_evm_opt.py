@@ -1,7 +1,4 @@
 import tx_setup
-from titan24_prototypes.modules.lo import LO
-from titan24_prototypes.modules.shf import SHF
-from titan24_prototypes.modules.mixer import Mixer
 import pandas as pd
 import numpy as np
 import time
@@ -16,15 +13,15 @@ def main():
     SN = input("SN?:")
     file_out = pd.ExcelWriter("bias_optim" + SN + ".xlsx")
 
-    trf = SHF("192.168.100.1")
-    tmix = Mixer("192.168.100.1")
+    bench = tx_setup.BenchSession()
+    trf = bench.shf
     pol = input("Pol H 1 ,v 0?")
     shf_id = int(pol)
     info = input("path (0 1 2 3): ")
     path_test = int(info)
     lo_freq = float(input("LO frequency: [GHz] "))
     # sets the LO frequency in the synth
-    tx_setup.set_lo(lo_freq)
+    bench.set_lo(lo_freq)
     trf.set_mode("tx", [shf_id])
 
     vdacm = np.arange(0.7, 0.45, -0.005)  # normally 1,0.6
@@ -44,8 +41,8 @@ def main():
         + "\npress enter when done"
     )
     for path in [path_test]:
-        tx_setup.set_all_off(shf_id)
-        tx_setup.tx_set_ch(shf_id, path, if_atten, mixer_atten1, mixer_atten2, gate_dac)
+        bench.set_all_off(shf_id)
+        bench.tx_set_ch(shf_id, path, if_atten, mixer_atten1, mixer_atten2, gate_dac)
         time.sleep(1)
 
         vdac = []
@@ -61,7 +58,8 @@ def main():
         att_if = trf.get_rf_tx_attenuator(shf_id, path)
         for vd in vdacm:
 
-            trf.set_rf_dac_voltage(shf_id, path, vd)
+            with bench.transaction() as trans:
+                trans.set_path(shf_id, path, gate_dac=vd)
             time.sleep(2)
 
             t_ch = trf.get_rf_temperature(shf_id, path, "rf")
@@ -84,10 +82,8 @@ def main():
             print("Path to set the IF DSA attenuator: ", path)
             print("Set to new atten = ", new_atten)
 
-            trf.set_rf_tx_attenuator(shf_id, path, new_atten, True)
-            trf.set_mode("rx", [shf_id])
-            time.sleep(0.4)
-            trf.set_mode("tx", [shf_id])
+            with bench.transaction() as trans:
+                trans.set_path(shf_id, path, if_atten_db=new_atten)
 
             read_atten = trf.get_rf_tx_attenuator(shf_id, path)
             print("Read atten RF board = ", read_atten)
@@ -103,13 +99,11 @@ def main():
             if_att_l.append(new_atten)
             print("Settings after  adjusting the IF DSA atten to the target power")
             print(vd, rms_pwr2, evm_meas2)
-            trf.set_rf_tx_attenuator(shf_id, path, att_if)
+            with bench.transaction() as trans:
+                trans.set_path(shf_id, path, if_atten_db=att_if)
 
-            trf.set_mode("rx", [shf_id])
-            time.sleep(0.4)
-            trf.set_mode("tx", [shf_id])
-
-        trf.set_rf_dac_voltage(shf_id, path, 2.99)
+        with bench.transaction() as trans:
+            trans.set_path(shf_id, path, gate_dac=2.99)
         out_np = np.column_stack([vdac, out_p, evm, temp, id12, vg, if_att_l])
         out_df = pd.DataFrame(
             out_np, columns=["Vd12", "Power", "EVM", "temp", "Id12", "Vg", "if_atten"]
@@ -1,28 +1,24 @@
 """Wrapper for QSR MFG mode (calstate 1) commands"""
 import re
+import math
+import time
 import logging
-from dataclasses import dataclass
-
-from s4_connect import S4Connect
+import itertools
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+from dataclasses import asdict, dataclass, field, replace
+
+from kmsg_monitor import KmsgMonitor, get_kmsg_monitor, release_kmsg_monitor
+from rx_monitor import RxMonitor
+from rx_stats import (  # pylint: disable=unused-import
+    SEARCH_PARAMS,
+    RxStats,
+    parse_rx_params,
+    parse_rx_stats,
+)
+from s4_connect import SESSION_POOL, S4Connect
 from utils import DEFAULT_ARMADA_IP, DEFAULT_QSR_IP
 
 
-SEARCH_PARAMS = {
-    "packets": r"(?:\[[0-9.]+ )?MPDU_GOOD = (\d+); MPDU_CRC = (\d+)",
-    "rate": r"(?:\[[0-9.]+ )?MCS = (?P<mcs>\d+); RX_SYMBOL_NUM = (?P<rx_sym_num>\d+); "
-    r"NSTS = (?P<nsts>\d+); BW = (?P<bandwidth>\d+); FORMAT = (?P<format>\d+)",
-    "ru": r"(?:\[[0-9.]+ )?RU_Size = (?P<ru_size>\d+); RU_Indx = (?P<ru_index>\d+);  "
-    r"SIGB_MCS = (?P<sigB_mcs>\d+);  GI_LTF = (?P<gi_ltf>\d+)",
-    "he_ltf": r"(?:\[[0-9.]+ )?Num_SIGB = (?P<num_sigB>\d+); Num_HE_LTF = (?P<num_he_ltf>\d+); "
-    r"STA_ID = (?P<sta_id>\d+);  TPE = (?P<TPE>\d+); A_fcator = (?P<a_factor>\d+); "
-    r"Disambiguity = (?P<disambiguity>\d+)",
-    "gain": r"(?:\[[0-9.]+ )?RX_GAIN = (?P<rx_gain>\d+); rgi = (?P<rgi>\d+); elna = (?P<elna>\d+)",
-    "rssi": r"(?:\[[0-9.]+ )?RX_RSSI_dBm  : (-?\d+\.\d+), (-?\d+\.\d+), (-?\d+\.\d+), "
-    r"(-?\d+\.\d+), (-?\d+\.\d+), (-?\d+\.\d+), (-?\d+\.\d+), (-?\d+\.\d+)",
-    "evm": r"(?:\[[0-9.]+ )?EVM_AVG : (-?\d+\.\d+), ( ?-?\d+\.\d+), ( ?-?\d+\.\d+), ( ?-?\d+\.\d+)",
-}
-
-
 @dataclass
 class TestModeConfig:
     """Configuration for set_test_mode"""
@@ -35,6 +31,201 @@ class TestModeConfig:
     phy_format: int = 2  # (0=11/b/a/g, 1=11n, 2=11ac, 3=11ax)
 
 
+@dataclass
+class MfgState:
+    """Test-mode state last applied to the modem; None means unknown
+
+    Commands are stored as sent, so a request matches when its command line
+    is identical.
+    """
+
+    modem: Optional[int] = None
+    test_mode: Optional[str] = None
+    tx_pow: Dict[int, str] = field(default_factory=dict)
+    # continuous send_test_packet running, "" when stopped; None after a finite
+    # burst, which stops by itself at an unknown time
+    packets: Optional[str] = None
+
+    def apply(self, cmd: str):
+        """Record the effect of a command that succeeded"""
+        name, _, args = cmd.partition(" ")
+        if name == "set_cal_modem":
+            # switching modem starts from scratch
+            self.modem = int(args)
+            self.test_mode = None
+            self.tx_pow = {}
+            self.packets = None
+        elif name == "set_tx_pow":
+            self.tx_pow[int(args.split()[0])] = cmd
+        elif name == "set_test_mode":
+            self.test_mode = cmd
+            self.packets = ""
+        elif name == "stop_test_packet":
+            self.packets = ""
+        elif name == "send_test_packet":
+            self.packets = None if int(args.split()[0]) else cmd
+        elif name in ("send_cw_signal", "stop_cw_signal"):
+            self.packets = None
+
+
+def parse_temperature(resp: str) -> float:
+    """Parse RFIC temperature in C from call_qcsapi get_temperature"""
+    return float(re.findall(r"\d+\.\d+", resp)[0])
+
+
+def tx_pow_cmd(spi_id: int, power_dbm: float) -> str:
+    """Build set_tx_pow command; see QsrMfg.set_tx_pow"""
+    if spi_id not in [0, 1, 2]:
+        raise IOError("Select valid spi_id from [0, 1, 2]")
+    power_to_set = int(round(power_dbm * 10))
+    return f"set_tx_pow {spi_id} {power_to_set} 1"
+
+
+def test_mode_cmd(config: TestModeConfig) -> str:
+    """Build set_test_mode command; see QsrMfg.set_test_mode"""
+    # center_channel = int((config.channel - 2) + (config.bandwidth_mhz / 10))
+    center_channel = config.channel
+    return (
+        f"set_test_mode {center_channel} {config.antenna_bitmask} "
+        f"{config.mcs} {config.bandwidth_mhz} {config.packet_length} "
+        f"{config.phy_format}"
+    )
+
+
+def test_packet_cmd(
+    packet_count: int = 0,
+    bandwidth: int = 99,
+    mpdu_per_ampdu: int = 1,
+    ppdu_mode: int = 0,
+) -> str:
+    """Build send_test_packet command; see QsrMfg.send_test_packet"""
+    trans_bw = {20: 0, 40: 1, 80: 2, 160: 3, 99: 99}
+
+    if bandwidth not in trans_bw.keys():
+        raise IOError(f"Invalid bandwidth {bandwidth}")
+    if mpdu_per_ampdu < 1 or mpdu_per_ampdu > 64:
+        raise IOError(f"Invalid MPDU per AMPDU {mpdu_per_ampdu}")
+    if ppdu_mode not in [0, 2, 4]:
+        raise IOError(f"Invalid PPDU Mode {ppdu_mode}")
+
+    params = f"{packet_count} {trans_bw[bandwidth]} {mpdu_per_ampdu - 1} {ppdu_mode}"
+    return f"send_test_packet {params}"
+
+
+@dataclass
+class MatrixPoint:
+    """One step of QsrMfg.run_matrix"""
+
+    config: TestModeConfig = field(default_factory=TestModeConfig)
+    tx_pow: Dict[int, float] = field(default_factory=dict)  # {spi_id: dBm}
+    packet_count: int = 0
+    bandwidth: int = 99
+    mpdu_per_ampdu: int = 1
+    ppdu_mode: int = 0
+
+    def commands(self, dwell: float) -> List[str]:
+        """Configure, then dump the RX statistics before and after transmitting
+        for dwell seconds
+
+        The dumps are the outputs of the third-to-last and last commands.
+        """
+        return [
+            "stop_test_packet",
+            test_mode_cmd(self.config),
+            *(tx_pow_cmd(spi_id, dbm) for spi_id, dbm in self.tx_pow.items()),
+            test_packet_cmd(
+                self.packet_count, self.bandwidth, self.mpdu_per_ampdu, self.ppdu_mode
+            ),
+            "dmesg -c > /dev/null",
+            "show_test_packet 8; dmesg -c",
+            f"sleep {dwell:g}",
+            "show_test_packet 8; dmesg -c",
+        ]
+
+
+def matrix_points(
+    base: TestModeConfig = TestModeConfig(),
+    power_dbm: Sequence[float] = (),
+    spi_ids: Sequence[int] = (0, 1),
+    **axes: Sequence,
+) -> List[MatrixPoint]:
+    """Cartesian product of TestModeConfig fields and TX powers
+
+    e.g. matrix_points(channel=[36, 100], mcs=range(10), power_dbm=[10, 13])
+
+    :param base: values of the fields that are not swept
+    :param power_dbm: TX powers applied to every spi_id; () leaves power alone
+    :param spi_ids: antenna groups that get the power
+    :param axes: TestModeConfig field name -> values to sweep
+    """
+    names = list(axes)
+    points = []
+    for values in itertools.product(*axes.values()):
+        config = replace(base, **dict(zip(names, values)))
+        for dbm in power_dbm or [None]:
+            tx_pow = {} if dbm is None else {spi_id: dbm for spi_id in spi_ids}
+            points.append(MatrixPoint(config, tx_pow))
+    return points
+
+
+class PerSprt:
+    """Wald sequential probability ratio test on packet error counts
+
+    H0: PER <= target * (1 - margin) (pass) against
+    H1: PER >= target * (1 + margin) (fail), with error rates
+    alpha = beta = 1 - confidence.
+    """
+
+    def __init__(self, target: float, confidence: float = 0.95, margin: float = 0.5):
+        if not 0 < target * (1 + margin) < 1 or not 0 < margin < 1:
+            raise IOError(f"Invalid PER target {target} / margin {margin}")
+        if not 0.5 < confidence < 1:
+            raise IOError(f"Invalid confidence {confidence}")
+        per_pass = target * (1 - margin)
+        per_fail = target * (1 + margin)
+        risk = 1 - confidence
+        self.llr_crc = math.log(per_fail / per_pass)
+        self.llr_good = math.log((1 - per_fail) / (1 - per_pass))
+        self.fail_above = math.log((1 - risk) / risk)
+        self.pass_below = -self.fail_above
+        self.good = 0
+        self.crc = 0
+
+    @property
+    def llr(self) -> float:
+        """Log likelihood ratio of fail over pass for the packets seen"""
+        return self.crc * self.llr_crc + self.good * self.llr_good
+
+    def update(self, good: int, crc: int) -> Optional[bool]:
+        """Add packets; return True (pass), False (fail) or None (keep going)"""
+        self.good += good
+        self.crc += crc
+        llr = self.llr
+        if llr >= self.fail_above:
+            return False
+        if llr <= self.pass_below:
+            return True
+        return None
+
+
+@dataclass
+class PerResult:
+    """Outcome of QsrMfg.measure_per"""
+
+    passed: Optional[bool]  # None if max_time ran out first
+    per: Optional[float]
+    good: int
+    crc: int
+    polls: int
+    elapsed_s: float
+
+
+def check_mfg_calstate(qsr: S4Connect):
+    """Raise RuntimeError unless the QSR is in calstate 1"""
+    if qsr.get_calstate() != 1:
+        raise RuntimeError("Not in calstate 1, exiting.")
+
+
 class QsrMfg:
     """Class for QSR10G in MFG mode (calstate 1)"""
 
@@ -44,21 +235,186 @@ class QsrMfg:
         telnet_port: int = 23,
         server_hostname: str = DEFAULT_ARMADA_IP,
         autostart: bool = False,
+        shared: bool = True,
     ):
         """Initialize the QsrDevice
         :param qsr_hostname: ip address for telnet
         :param telnet_port: port for telnet
         :param server_hostname: server (Dell/NUC) hostname
         :autostart: connect immediately or wait until sending command
+        :shared: use the process-wide session from SESSION_POOL (connects
+            immediately; calstate is only checked once per session)
         """
         self.logger = logging.getLogger(__name__)
+        self.kmsg_monitor: Optional[KmsgMonitor] = None
+        self.rx_monitor: Optional[RxMonitor] = None
+        self._rx_owns_kmsg = False  # start_rx_monitor started kmsg_monitor
+        client_config = {"hostname": qsr_hostname, "telnet_port": telnet_port}
+        server_config = {"hostname": server_hostname}
+        if shared:
+            self.qsr = SESSION_POOL.get(
+                client_config, server_config, verify=check_mfg_calstate
+            )
+            return
         self.qsr = S4Connect(
-            client_config={"hostname": qsr_hostname, "telnet_port": telnet_port},
-            server_config={"hostname": server_hostname},
+            client_config=client_config,
+            server_config=server_config,
             autostart=autostart,
         )
-        if self.qsr.get_calstate() != 1:
-            raise RuntimeError("Not in calstate 1, exiting.")
+        check_mfg_calstate(self.qsr)
+
+    @property
+    def state(self) -> MfgState:
+        """Test-mode state tracked on the (possibly shared) session
+
+        It is reset when the session reconnects. Commands sent around QsrMfg,
+        e.g. with qsr.communicate_trig, are not tracked; call forget_state()
+        after them.
+        """
+        return self.qsr.device_state.setdefault("mfg", MfgState())
+
+    def forget_state(self):
+        """Treat the test-mode state as unknown; the next request sends everything"""
+        self.qsr.device_state.pop("mfg", None)
+
+    def _send(self, cmds: List[str]) -> Tuple[str, int]:
+        """Send cmds in one round trip and record those that succeeded
+
+        :return: (response, exit code) of the last command, ("", 0) if none
+        """
+        if not cmds:
+            return "", 0
+        results = self.qsr.communicate_many(cmds)
+        self._record(zip(cmds, (status for _, status in results)))
+        return results[-1]
+
+    def _record(self, sent: Iterable[Tuple[str, int]]):
+        """Apply (command, exit code) pairs to the state, in order"""
+        state = self.state
+        for cmd, status in sent:
+            if status:
+                self.forget_state()
+                return
+            state.apply(cmd)
+
+    def _converge(
+        self, test_mode: str, packets: str, force: bool = False
+    ) -> Tuple[str, int]:
+        """Send what is needed to reach test_mode with packets running ("" = none)
+
+        A finite burst (packet_count > 0) is always sent; it is never recorded
+        as running.
+        """
+        state = self.state
+        cmds = []
+        if force or state.test_mode != test_mode:
+            if force or state.packets != "":
+                cmds.append("stop_test_packet")
+            cmds.append(test_mode)
+            running = ""
+        else:
+            running = state.packets
+        if packets != running:
+            if running is None and packets:
+                # a previous burst may still be going
+                cmds.append("stop_test_packet")
+            cmds.append(packets or "stop_test_packet")
+        return self._send(cmds)
+
+    def run_matrix(
+        self, configs: Iterable[Union[TestModeConfig, MatrixPoint]], dwell: float = 1.0
+    ) -> List[dict]:
+        """Step through a test-mode matrix in one script run on the QSR
+
+        Every point is configured, transmits for dwell seconds and has its
+        show_test_packet dump read, all on the device, so the matrix costs
+        about the sum of the dwell times plus a single round trip.
+
+        :param configs: TestModeConfigs or MatrixPoints, see matrix_points()
+        :param dwell: seconds to transmit at each point before reading RX stats
+        :return: one row per point: TestModeConfig fields, tx_pow, rx_params
+            (the dump after the dwell in show_test_packet layout), per over the
+            dwell and status (worst exit code)
+        """
+        points = [
+            point if isinstance(point, MatrixPoint) else MatrixPoint(point)
+            for point in configs
+        ]
+        cmds = [point.commands(dwell) for point in points]
+        steps = self.qsr.run_batch([cmd for point in cmds for cmd in point])
+        self._record((step.command, step.status) for step in steps)
+        rows = []
+        for point, point_cmds in zip(points, cmds):
+            point_steps, steps = steps[: len(point_cmds)], steps[len(point_cmds) :]
+            if len(point_steps) < len(point_cmds):
+                self.logger.error(f"Matrix point did not finish: {point}")
+                point_steps = []
+            first = parse_rx_stats(point_steps[-3].output if point_steps else "")
+            stats = parse_rx_stats(point_steps[-1].output if point_steps else "")
+            counts = stats.counts_since(first)
+            per = None
+            if counts is not None and sum(counts):
+                per = counts[1] / sum(counts)
+            rows.append(
+                {
+                    **asdict(point.config),
+                    "tx_pow": dict(point.tx_pow),
+                    "rx_params": stats.to_dict(),
+                    "per": per,
+                    "status": max((step.status for step in point_steps), default=-1),
+                }
+            )
+        return rows
+
+    def measure_per(
+        self,
+        target: float,
+        confidence: float = 0.95,
+        margin: float = 0.5,
+        poll_s: float = 0.2,
+        max_time: float = 60,
+    ) -> PerResult:
+        """Decide whether PER is below target, stopping as soon as it is clear
+
+        The MPDU counters are polled with read_rx_stats and only the packets
+        received since the first poll count. Clearly good or bad links are
+        decided after a few polls; links close to target run up to max_time.
+
+        :param target: PER limit, e.g. 0.1
+        :param confidence: probability of a correct decision outside the
+            indifference band target * (1 +/- margin)
+        :param margin: relative half-width of the indifference band
+        :param poll_s: seconds between counter reads
+        :param max_time: give up after this long; passed is then None
+        """
+        sprt = PerSprt(target, confidence, margin)
+        start = time.monotonic()
+        last = self.read_rx_stats()
+        polls = 1
+        passed = None
+        while passed is None and time.monotonic() - start < max_time:
+            time.sleep(poll_s)
+            stats = self.read_rx_stats()
+            polls += 1
+            if stats.mpdu_good is None:
+                # keep last so the packets of this interval count next time
+                continue
+            counts = stats.counts_since(last)
+            last = stats
+            if counts is not None:
+                passed = sprt.update(*counts)
+        total = sprt.good + sprt.crc
+        result = PerResult(
+            passed=passed,
+            per=sprt.crc / total if total else None,
+            good=sprt.good,
+            crc=sprt.crc,
+            polls=polls,
+            elapsed_s=round(time.monotonic() - start, 3),
+        )
+        if passed is None:
+            self.logger.warning(f"PER undecided after {max_time} s: {result}")
+        return result
 
     def get_temperature(self) -> float:
         """Get QT7810 (RFIC) temperature.
@@ -67,19 +423,23 @@ class QsrMfg:
         :return: RFIC temperature in C
         """
         resp = self.qsr.communicate_trig("call_qcsapi get_temperature")[0]
-        rfic_temp_c = float(re.findall("\d+\.\d+", resp)[0])
-        return rfic_temp_c
+        return parse_temperature(resp)
 
-    def set_cal_modem(self, modem: int = 0):
-        """Set modem (5GHz or 2.4 GHz)
+    def set_cal_modem(self, modem: int = 0, force: bool = False):
+        """Set modem (5GHz or 2.4 GHz); skipped if already selected
 
         :param modem: 0 = 5 GHz, 2 = 2.4 GHz
+        :param force: send even if the modem is already selected
         """
         if modem not in [0, 2]:
             raise IOError("Select valid modem from [0, 2]")
-        return self.qsr.communicate_trig(f"set_cal_modem {modem}")
+        if not force and self.state.modem == modem:
+            return "", 0
+        return self._send([f"set_cal_modem {modem}"])
 
-    def set_tx_pow(self, spi_id: int = 0, power_dbm: float = 13.0):
+    def set_tx_pow(
+        self, spi_id: int = 0, power_dbm: float = 13.0, force: bool = False
+    ):
         """Set modem TX power with resolution of 0.1 dB
         Note: needs more experimentation to determine how this works.
         May be using LNA gain settings to set total power out?
@@ -89,26 +449,45 @@ class QsrMfg:
             1 = antenna group 2
             2 = 2.4 GHz antenna group 3
         :param power_dbm: desired output power in dBm
+        :param force: send even if this power is already set
         """
-        if spi_id not in [0, 1, 2]:
-            raise IOError("Select valid spi_id from [0, 1, 2]")
-        power_to_set = int(power_dbm * 10)
-        return self.qsr.communicate_trig(f"set_tx_pow {spi_id} {power_to_set} 1")
+        cmd = tx_pow_cmd(spi_id, power_dbm)
+        if not force and self.state.tx_pow.get(spi_id) == cmd:
+            return "", 0
+        return self._send([cmd])
 
-    def set_test_mode(self, config: TestModeConfig = TestModeConfig):
-        """Set the parameters to transmit
+    def set_test_mode(
+        self, config: TestModeConfig = TestModeConfig, force: bool = False
+    ):
+        """Set the parameters to transmit, with packets stopped
+
+        Only stop_test_packet is sent if config is already applied.
 
         :param config: TestModeConfig with parameters to set
+        :param force: always send stop_test_packet and set_test_mode
         """
-        self.stop_test_packet()
-        # center_channel = int((config.channel - 2) + (config.bandwidth_mhz / 10))
-        center_channel = config.channel
-        cmd = (
-            f"set_test_mode {center_channel} {config.antenna_bitmask} "
-            f"{config.mcs} {config.bandwidth_mhz} {config.packet_length} "
-            f"{config.phy_format}"
-        )
-        return self.qsr.communicate_trig(cmd)
+        return self._converge(test_mode_cmd(config), "", force)
+
+    def transmit(
+        self,
+        config: TestModeConfig = TestModeConfig,
+        packet_count: int = 0,
+        bandwidth: int = 99,
+        mpdu_per_ampdu: int = 1,
+        ppdu_mode: int = 0,
+        force: bool = False,
+    ):
+        """Transmit packets with config, sending only the commands that changed
+
+        Equivalent to set_test_mode(config) + send_test_packet(...), but
+        nothing is sent when the modem is already transmitting continuously
+        with exactly these settings. Finite bursts are always sent.
+        See send_test_packet for the packet parameters.
+
+        :param force: always send set_test_mode and send_test_packet
+        """
+        packets = test_packet_cmd(packet_count, bandwidth, mpdu_per_ampdu, ppdu_mode)
+        return self._converge(test_mode_cmd(config), packets, force)
 
     def send_test_packet(
         self,
@@ -116,8 +495,9 @@ class QsrMfg:
         bandwidth: int = 99,
         mpdu_per_ampdu: int = 1,
         ppdu_mode: int = 0,
+        force: bool = False,
     ):
-        """Transmit packets.
+        """Transmit packets; skipped if the same continuous transmission is running
 
         :param packet_count: number of packets to transmit
             Note: default 0 transmits continuous
@@ -126,25 +506,18 @@ class QsrMfg:
         :param mpdu_per_ampdu: number of MPDU per AMPDU
         :param ppdu_mode: PPDU mode
             Note: only value 0 has been tested
+        :param force: send even if this transmission is already running
         """
-        trans_bw = {20: 0, 40: 1, 80: 2, 160: 3, 99: 99}
+        cmd = test_packet_cmd(packet_count, bandwidth, mpdu_per_ampdu, ppdu_mode)
+        if not force and self.state.packets == cmd:
+            return "", 0
+        return self._send([cmd])
 
-        if bandwidth not in trans_bw.keys():
-            raise IOError(f"Invalid bandwidth {bandwidth}")
-        if mpdu_per_ampdu < 1 or mpdu_per_ampdu > 64:
-            raise IOError(f"Invalid MPDU per AMPDU {mpdu_per_ampdu}")
-        if ppdu_mode not in [0, 2, 4]:
-            raise IOError(f"Invalid PPDU Mode {ppdu_mode}")
-
-        params = (
-            f"{packet_count} {trans_bw[bandwidth]} {mpdu_per_ampdu - 1} {ppdu_mode}"
-        )
-
-        return self.qsr.communicate_trig(f"send_test_packet {params}")
-
-    def stop_test_packet(self):
-        """Stop transmitting packets"""
-        return self.qsr.communicate_trig("stop_test_packet")
+    def stop_test_packet(self, force: bool = False):
+        """Stop transmitting packets; skipped if known to be stopped"""
+        if not force and self.state.packets == "":
+            return "", 0
+        return self._send(["stop_test_packet"])
 
     def start_cw_signal(self, channel: int = 36):
         """Start transmitting CW signal. Warning: pretty sure it doesn't work
@@ -153,56 +526,102 @@ class QsrMfg:
         """
         self.stop_cw_signal()
         center_channel = int((channel - 2) + 16)
-        return self.qsr.communicate_trig(f"send_cw_signal {center_channel} 0 0 0 0 1 1")
+        return self._send([f"send_cw_signal {center_channel} 0 0 0 0 1 1"])
 
     def stop_cw_signal(self):
         """Stop transmitting CW signal"""
-        return self.qsr.communicate_trig("stop_cw_signal")
+        return self._send(["stop_cw_signal"])
 
-    def show_test_packet(self, show: bool = False):
-        """Parses show_test_packet
+    def start_kmsg_monitor(self) -> KmsgMonitor:
+        """Tail the kernel log on a second session
 
-        :param show: print rx parameters to the command line
+        While it runs, show_test_packet reads its dump from the monitor instead
+        of clearing and reading dmesg. The monitor is shared with every QsrMfg
+        on the same QSR.
+        """
+        if self.kmsg_monitor is not None:
+            return self.kmsg_monitor.start()
+        self.kmsg_monitor = get_kmsg_monitor(
+            self.qsr.client_config, asdict(self.qsr.server_config)
+        )
+        return self.kmsg_monitor
+
+    def stop_kmsg_monitor(self):
+        """Go back to reading show_test_packet dumps from dmesg
+
+        The shared monitor keeps running while other QsrMfg instances use it.
+        """
+        if self.kmsg_monitor is not None:
+            release_kmsg_monitor(self.kmsg_monitor)
+            self.kmsg_monitor = None
+
+    def start_rx_monitor(
+        self, rate_hz: float = 10.0, capacity: int = 4096
+    ) -> RxMonitor:
+        """Sample show_test_packet in the background into a numpy ring buffer
+
+        Samples are read through the kernel log monitor, which is started too
+        unless this instance already uses it; stop_rx_monitor() releases it
+        again in that case. Use rx_monitor.summary() for EVM/RSSI statistics and PER.
+
+        :param rate_hz: samples per second
+        :param capacity: samples kept
+        """
+        self.stop_rx_monitor()
+        if self.kmsg_monitor is None:
+            self._rx_owns_kmsg = True
+        self.start_kmsg_monitor()
+        self.rx_monitor = RxMonitor(self.read_rx_stats, rate_hz, capacity).start()
+        return self.rx_monitor
+
+    def stop_rx_monitor(self):
+        """Stop sampling and the kernel log monitor started with it
+
+        The last buffer stays in rx_monitor.
+        """
+        if self.rx_monitor is not None:
+            self.rx_monitor.stop()
+        if self._rx_owns_kmsg:
+            self.stop_kmsg_monitor()
+            self._rx_owns_kmsg = False
+
+    def read_rx_stats(self, timeout: float = 5) -> RxStats:
+        """Run show_test_packet and return the dump as an RxStats record
+
+        :param timeout: seconds to wait for the dump from the kernel log monitor
         """
-        rx_params = {}
+        if self.kmsg_monitor is not None and self.kmsg_monitor.running:
+            seq = self.kmsg_monitor.seq
+            self.qsr.communicate_trig("show_test_packet 8")
+            stats = self.kmsg_monitor.wait_next(seq, timeout)
+            if stats is not None:
+                return stats
+            self.logger.warning("No show_test_packet dump from kernel log monitor")
         # Clear dmesg to get output of only show_test_packet command
         self.qsr.communicate_trig("dmesg -c")
         raw_output = self.qsr.communicate_trig("show_test_packet 8; dmesg -c")[0]
+        return parse_rx_stats(raw_output)
+
+    def dmesg(self, clear: bool = False) -> str:
+        """Whole kernel log, streamed line by line; see rx_log for parsing it
+
+        :param clear: clear the kernel log after reading it
+        """
+        return "\n".join(self.qsr.stream("dmesg -c" if clear else "dmesg"))
 
-        match_rx = re.search(SEARCH_PARAMS["packets"], raw_output)
-        match_evm = re.search(SEARCH_PARAMS["evm"], raw_output)
-        match_rssi = re.search(SEARCH_PARAMS["rssi"], raw_output)
-        match_rate = re.search(SEARCH_PARAMS["rate"], raw_output)
-        match_ru = re.search(SEARCH_PARAMS["ru"], raw_output)
-        match_he = re.search(SEARCH_PARAMS["he_ltf"], raw_output)
-        match_gain = re.search(SEARCH_PARAMS["gain"], raw_output)
-
-        try:
-            rx_params["rf_rx"] = [int(match_rx.group(i)) for i in [1, 2]]
-        except (AttributeError, ValueError):
-            self.logger.error("Could not parse RX packet numbers")
-        try:
-            rx_params["evm"] = [float(match_evm.group(i)) for i in range(1, 5)]
-        except (AttributeError, ValueError):
-            self.logger.error("Could not parse RX EVM")
-        try:
-            rx_params["rssi"] = [float(match_rssi.group(i)) for i in range(1, 9)]
-        except (AttributeError, ValueError):
-            self.logger.error("Could not parse RX RSSI")
-        try:
-            for key, value in match_rate.groupdict().items():
-                if key == "bandwidth":
-                    rx_params[key] = 20 * (2 ** int(value))
-                else:
-                    rx_params[key] = int(value)
-            for key, value in match_ru.groupdict().items():
-                rx_params[key] = int(value)
-            for key, value in match_he.groupdict().items():
-                rx_params[key] = int(value)
-            for key, value in match_gain.groupdict().items():
-                rx_params[key] = int(value)
-        except (AttributeError, ValueError):
-            self.logger.error("Could not parse additional RX parameters")
+    def show_test_packet(self, show: bool = False, timeout: float = 5):
+        """Parses show_test_packet
+
+        :param show: print rx parameters to the command line
+        :param timeout: seconds to wait for the dump from the kernel log monitor
+        """
+        if self.kmsg_monitor is not None and self.kmsg_monitor.running:
+            rx_params = self.read_rx_stats(timeout).to_dict()
+        else:
+            # Clear dmesg to get output of only show_test_packet command
+            self.qsr.communicate_trig("dmesg -c")
+            raw_output = self.qsr.communicate_trig("show_test_packet 8; dmesg -c")[0]
+            rx_params = parse_rx_params(raw_output, self.logger)
 
         if show:
             print("Full list of rx parameters: ")
@@ -0,0 +1,627 @@
+"""Local QSR10G telnet simulator for offline testing and benchmarking
+
+Speaks the same login/prompt protocol as the QSR (soc1 login: / quantenna # ),
+runs a small subset of the busybox shell (;, &&, ||, |, > redirection,
+heredocs, $? and variables, echo, printf, [ ], sh, cat, rm, sleep, exit) and
+answers the MFG-mode commands used by S4Connect and QsrMfg with realistic
+output and configurable latency.
+
+Usage:
+    python qsr_sim.py --port 2323 --latency-ms 5 --jitter-ms 2
+    qsr = QsrMfg("127.0.0.1", telnet_port=2323)
+"""
+import re
+import math
+import time
+import shlex
+import random
+import socket
+import select
+import argparse
+import threading
+import socketserver
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from telnet_socket import IAC, WILL, TelnetFilter
+
+ECHO_OPT = 1
+SGA_OPT = 3
+HEREDOC_RE = re.compile(r"<<\s*'?\"?(\w+)'?\"?")
+VAR_RE = re.compile(r"\$(\?|\w+)")
+# Commands that talk to the modem and pay the simulated device latency
+DEVICE_COMMANDS = {
+    "call_qcsapi",
+    "set_cal_modem",
+    "set_tx_pow",
+    "set_test_mode",
+    "send_test_packet",
+    "stop_test_packet",
+    "show_test_packet",
+    "send_cw_signal",
+    "stop_cw_signal",
+}
+
+
+@dataclass
+class QsrSimConfig:
+    """Configuration for the simulator"""
+
+    host: str = "127.0.0.1"
+    port: int = 0
+    calstate: int = 1
+    latency_s: float = 0.005
+    jitter_s: float = 0.002
+    # per-command latency overrides, e.g. {"show_test_packet": 0.05}
+    command_latency_s: Dict[str, float] = field(default_factory=dict)
+    temperature_c: float = 52.0
+    packet_rate_pps: float = 2000.0
+    per: float = 0.01
+    rssi_dbm: float = -45.0
+    evm_db: float = -35.0
+    seed: Optional[int] = None
+
+
+class ShellExit(Exception):
+    """exit called inside the simulated shell"""
+
+    def __init__(self, status: int):
+        super().__init__(status)
+        self.status = status
+
+
+class ShellInterrupt(Exception):
+    """Ctrl-C received while a command was running"""
+
+
+class QsrSimState:
+    """Device state shared by every session of one simulator"""
+
+    def __init__(self, config: QsrSimConfig):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.lock = threading.Lock()
+        self.boot = time.monotonic()
+        self.kmsg: List[str] = []
+        self.kmsg_cond = threading.Condition(self.lock)
+        self.kmsg_seq = 0
+        self.files: Dict[str, str] = {}
+        self.bootcfg = {"calstate": str(config.calstate)}
+        self.test_mode: Optional[List[str]] = None
+        self.rx_start = time.monotonic()
+        self.tx_params: Optional[List[str]] = None
+        self.tx_pow: Dict[str, str] = {}
+        self.modem = "0"
+
+    def log_kernel(self, lines: List[str]):
+        """Append lines to the kernel log with a [ts] prefix"""
+        with self.lock:
+            stamp = time.monotonic() - self.boot
+            self.kmsg.extend(f"[{stamp:12.6f}] {line}" for line in lines)
+            self.kmsg_seq += len(lines)
+            self.kmsg_cond.notify_all()
+
+    def device_delay(self, name: str):
+        """Sleep for the simulated device latency of a command"""
+        cfg = self.config
+        delay = cfg.command_latency_s.get(name, cfg.latency_s)
+        delay += self.rng.uniform(-cfg.jitter_s, cfg.jitter_s)
+        if delay > 0:
+            time.sleep(delay)
+
+    def rx_stats_block(self) -> List[str]:
+        """One show_test_packet dump based on the current test mode"""
+        cfg = self.config
+        rng = self.rng
+        elapsed = time.monotonic() - self.rx_start
+        total = int(elapsed * cfg.packet_rate_pps)
+        spread = math.sqrt(total * cfg.per * (1 - cfg.per))
+        crc = min(max(int(round(total * cfg.per + rng.gauss(0, spread))), 0), total)
+        mode = self.test_mode or ["114", "255", "9", "160", "40", "2"]
+        bw_code = {"20": 0, "40": 1, "80": 2, "160": 3}.get(mode[3], 3)
+        rssi = ", ".join(
+            f"{cfg.rssi_dbm + rng.uniform(-2, 2):.2f}" for _ in range(8)
+        )
+        evm = ", ".join(f"{cfg.evm_db + rng.uniform(-1, 1):.2f}" for _ in range(4))
+        return [
+            f"MPDU_GOOD = {total - crc}; MPDU_CRC = {crc}",
+            f"MCS = {mode[2]}; RX_SYMBOL_NUM = {rng.randint(100, 140)}; "
+            f"NSTS = 2; BW = {bw_code}; FORMAT = {mode[5]}",
+            "RU_Size = 0; RU_Indx = 0;  SIGB_MCS = 0;  GI_LTF = 1",
+            "Num_SIGB = 0; Num_HE_LTF = 2; STA_ID = 0;  TPE = 0; A_fcator = 0; "
+            "Disambiguity = 0",
+            f"RX_GAIN = {rng.randint(38, 42)}; rgi = 12; elna = 1",
+            f"RX_RSSI_dBm  : {rssi}",
+            f"EVM_AVG : {evm}",
+        ]
+
+
+class QsrShell:
+    """Tiny busybox-like shell bound to one session"""
+
+    def __init__(
+        self,
+        state: QsrSimState,
+        write,
+        interrupted: Callable[[], bool] = lambda: False,
+    ):
+        self.state = state
+        self.write = write
+        self.interrupted = interrupted
+        self.vars: Dict[str, str] = {"?": "0"}
+
+    def expand(self, word: str) -> str:
+        """Expand $? and $NAME"""
+        return VAR_RE.sub(lambda m: self.vars.get(m.group(1), ""), word)
+
+    def run(self, text: str, heredoc: Optional[str] = None, stream: bool = True):
+        """Run one command line; output is written as each pipeline finishes
+
+        :return: collected output when stream is False
+        """
+        lexer = shlex.shlex(text, posix=True, punctuation_chars=True)
+        lexer.whitespace_split = True
+        try:
+            tokens = list(lexer)
+        except ValueError as err:
+            self.vars["?"] = "2"
+            return self._emit(f"sh: syntax error: {err}\n", stream)
+        collected = []
+        op = ";"
+        pipeline: List[str] = []
+        for token in tokens + [";"]:
+            if token not in (";", "&&", "||", "&"):
+                pipeline.append(token)
+                continue
+            if pipeline:
+                status = int(self.vars["?"])
+                if op == ";" or (op == "&&") == (status == 0):
+                    out = self._run_pipeline(pipeline, heredoc)
+                    collected.append(self._emit(out, stream))
+            pipeline = []
+            op = token
+        return "".join(collected)
+
+    def _emit(self, out: str, stream: bool) -> str:
+        if stream and out:
+            self.write(out)
+        return out
+
+    def _run_pipeline(self, tokens: List[str], heredoc: Optional[str]) -> str:
+        stdin = ""
+        out = ""
+        commands: List[List[str]] = [[]]
+        for token in tokens:
+            if token == "|":
+                commands.append([])
+            else:
+                commands[-1].append(token)
+        for argv in commands:
+            out = self._run_simple(argv, stdin, heredoc)
+            stdin = out
+        return out
+
+    def _run_simple(self, tokens: List[str], stdin: str, heredoc: Optional[str]) -> str:
+        argv = []
+        redirect: Optional[Tuple[str, str]] = None
+        idx = 0
+        while idx < len(tokens):
+            token = tokens[idx]
+            if token in (">", ">>") and idx + 1 < len(tokens):
+                redirect = (token, self.expand(tokens[idx + 1]))
+                idx += 2
+            elif token == "<<" and idx + 1 < len(tokens):
+                stdin = heredoc or ""
+                idx += 2
+            else:
+                argv.append(self.expand(token))
+                idx += 1
+        if argv and re.match(r"^\w+=", argv[0]):
+            name, value = argv[0].split("=", 1)
+            self.vars[name] = value
+            self.vars["?"] = "0"
+            return ""
+        try:
+            out, status = self._dispatch(argv, stdin)
+        except (ShellExit, ShellInterrupt):
+            raise
+        except Exception as err:  # pylint: disable=broad-except
+            out, status = f"sh: {argv[0]}: {err}\n", 1
+        self.vars["?"] = str(status)
+        if redirect is not None:
+            mode, path = redirect
+            if path != "/dev/null":
+                with self.state.lock:
+                    old = self.state.files.get(path, "") if mode == ">>" else ""
+                    self.state.files[path] = old + out
+            return ""
+        return out
+
+    def _dispatch(self, argv: List[str], stdin: str) -> Tuple[str, int]:
+        if not argv:
+            return "", 0
+        name, args = argv[0], argv[1:]
+        state = self.state
+        if name in DEVICE_COMMANDS:
+            state.device_delay(args[0] if name == "call_qcsapi" and args else name)
+        handler = getattr(self, f"cmd_{name.replace('[', 'test')}", None)
+        if handler is None:
+            return f"sh: {name}: not found\n", 127
+        return handler(args, stdin)
+
+    # --- shell builtins -------------------------------------------------
+
+    def cmd_echo(self, args, stdin):
+        return " ".join(args) + "\n", 0
+
+    def cmd_printf(self, args, stdin):
+        fmt = args[0].encode().decode("unicode_escape") if args else ""
+        values = args[1:]
+        count = fmt.count("%s") + fmt.count("%d")
+        values = (values + [""] * count)[:count]
+        return fmt.replace("%d", "%s") % tuple(values), 0
+
+    def cmd_true(self, args, stdin):
+        return "", 0
+
+    def cmd_false(self, args, stdin):
+        return "", 1
+
+    def cmd_sleep(self, args, stdin):
+        end = time.monotonic() + (float(args[0]) if args else 0)
+        while time.monotonic() < end:
+            if self.interrupted():
+                raise ShellInterrupt()
+            time.sleep(min(0.05, max(end - time.monotonic(), 0)))
+        return "", 0
+
+    def cmd_exit(self, args, stdin):
+        raise ShellExit(int(args[0]) if args else int(self.vars["?"]))
+
+    def cmd_test(self, args, stdin):
+        if args and args[-1] == "]":
+            args = args[:-1]
+        ops = {
+            "-eq": lambda a, b: int(a) == int(b),
+            "-ne": lambda a, b: int(a) != int(b),
+            "=": lambda a, b: a == b,
+            "!=": lambda a, b: a != b,
+        }
+        if len(args) == 3 and args[1] in ops:
+            return "", 0 if ops[args[1]](args[0], args[2]) else 1
+        if len(args) == 2 and args[0] in ("-e", "-f"):
+            return "", 0 if args[1] in self.state.files else 1
+        if len(args) == 2 and args[0] == "-d":
+            return "", 1
+        return "", 0 if args and args[0] else 1
+
+    def cmd_cat(self, args, stdin):
+        if not args:
+            return stdin, 0
+        if args == ["/proc/kmsg"]:
+            return self._tail_kmsg(), 0
+        files = self.state.files
+        missing = [path for path in args if path not in files]
+        if missing:
+            return f"cat: can't open '{missing[0]}': No such file or directory\n", 1
+        return "".join(files[path] for path in args), 0
+
+    def cmd_rm(self, args, stdin):
+        for path in args:
+            if not path.startswith("-"):
+                self.state.files.pop(path, None)
+        return "", 0
+
+    def cmd_sh(self, args, stdin):
+        script = self.state.files.get(args[0]) if args else stdin
+        if script is None:
+            return f"sh: can't open '{args[0]}': No such file or directory\n", 2
+        shell = QsrShell(self.state, self.write, self.interrupted)
+        try:
+            for line in script.splitlines():
+                if line.strip():
+                    shell.run(line)
+        except ShellExit as err:
+            return "", err.status
+        return "", int(shell.vars["?"])
+
+    def cmd_dmesg(self, args, stdin):
+        with self.state.lock:
+            out = "".join(f"{line}\n" for line in self.state.kmsg)
+            if "-c" in args:
+                self.state.kmsg = []
+        return out, 0
+
+    def _tail_kmsg(self) -> str:
+        """Stream new kernel messages until interrupted"""
+        state = self.state
+        with state.lock:
+            seen = state.kmsg_seq
+        while not self.interrupted():
+            with state.kmsg_cond:
+                state.kmsg_cond.wait_for(lambda: state.kmsg_seq > seen, timeout=0.05)
+                new = state.kmsg_seq - seen
+                lines = state.kmsg[len(state.kmsg) - new :] if new else []
+                seen = state.kmsg_seq
+            if lines:
+                self.write("".join(f"{line}\n" for line in lines))
+        raise ShellInterrupt()
+
+    # --- QSR MFG commands -------------------------------------------------
+
+    def cmd_call_qcsapi(self, args, stdin):
+        state = self.state
+        sub = args[0] if args else ""
+        if sub == "get_bootcfg_param" and len(args) > 1:
+            if args[1] not in state.bootcfg:
+                return "QCS API error 22: Invalid argument\n", 1
+            return f"{state.bootcfg[args[1]]}\n", 0
+        if sub == "update_bootcfg_param" and len(args) > 2:
+            state.bootcfg[args[1]] = args[2]
+            return "complete\n", 0
+        if sub == "get_temperature":
+            temp = state.config.temperature_c + state.rng.uniform(-0.5, 0.5)
+            return f"temperature_rfic_external = {temp:.6f}\n", 0
+        if sub == "get_firmware_version":
+            return "v37.4.0.91\n", 0
+        if sub == "get_mac_addr":
+            return "00:26:86:f0:00:01\n", 0
+        if sub == "run_script":
+            return "complete\n", 0
+        return f"QCS API error 95: Operation not supported: {sub}\n", 1
+
+    def cmd_set_cal_modem(self, args, stdin):
+        self.state.modem = args[0] if args else "0"
+        return "complete\n", 0
+
+    def cmd_set_tx_pow(self, args, stdin):
+        if len(args) < 2:
+            return "usage: set_tx_pow <spi_id> <power> <flag>\n", 1
+        self.state.tx_pow[args[0]] = args[1]
+        return "complete\n", 0
+
+    def cmd_set_test_mode(self, args, stdin):
+        if len(args) < 6:
+            return "usage: set_test_mode <ch> <ant> <mcs> <bw> <len> <fmt>\n", 1
+        self.state.test_mode = args[:6]
+        self.state.rx_start = time.monotonic()
+        return "complete\n", 0
+
+    def cmd_send_test_packet(self, args, stdin):
+        self.state.tx_params = args
+        return "complete\n", 0
+
+    def cmd_stop_test_packet(self, args, stdin):
+        self.state.tx_params = None
+        return "complete\n", 0
+
+    def cmd_send_cw_signal(self, args, stdin):
+        return "complete\n", 0
+
+    def cmd_stop_cw_signal(self, args, stdin):
+        return "complete\n", 0
+
+    def cmd_show_test_packet(self, args, stdin):
+        self.state.log_kernel(self.state.rx_stats_block())
+        return "complete\n", 0
+
+
+class QsrSimHandler(socketserver.BaseRequestHandler):
+    """One telnet session"""
+
+    server: "QsrSimServer"
+
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.sessions.add(self.request)
+        self.filter = TelnetFilter()
+        self.buffer = bytearray()
+
+    def send(self, text: str):
+        """Send text with tty newline translation"""
+        self.request.sendall(text.replace("\r\n", "\n").replace("\n", "\r\n").encode())
+
+    def readline(self) -> Optional[str]:
+        """Read one input line without its newline; None on disconnect
+
+        :raises ShellInterrupt: Ctrl-C arrived before the end of the line
+        """
+        while True:
+            idx = self.buffer.find(b"\n")
+            ctrl = self.buffer.find(b"\x03")
+            if ctrl >= 0 and (idx < 0 or ctrl < idx):
+                del self.buffer[: ctrl + 1]
+                raise ShellInterrupt()
+            if idx >= 0:
+                break
+            data = self.request.recv(65536)
+            if not data:
+                return None
+            self.buffer += self.filter.feed(data)[0]
+        line = bytes(self.buffer[:idx]).decode(errors="replace").rstrip("\r")
+        del self.buffer[: idx + 1]
+        return line
+
+    def interrupted(self) -> bool:
+        """Check for Ctrl-C without blocking; like a tty, it drops pending input"""
+        if select.select([self.request], [], [], 0)[0]:
+            data = self.request.recv(65536)
+            if not data:
+                raise OSError("Session closed")
+            self.buffer += self.filter.feed(data)[0]
+        if b"\x03" not in self.buffer:
+            return False
+        self.buffer.clear()
+        return True
+
+    def finish(self):
+        self.server.sessions.discard(self.request)
+
+    def handle(self):
+        try:
+            self._handle()
+        except OSError:
+            pass
+
+    def _handle(self):
+        self.request.sendall(bytes((IAC, WILL, ECHO_OPT, IAC, WILL, SGA_OPT)))
+        self.send("soc1 login: ")
+        if self.readline() is None:
+            return
+        self.send("\nquantenna # ")
+        shell = QsrShell(self.server.state, self.send, self.interrupted)
+        while True:
+            try:
+                command = self._read_command()
+            except ShellInterrupt:
+                # Ctrl-C at the prompt drops the line being typed
+                self.send("^C\nquantenna # ")
+                continue
+            if command is None:
+                return
+            try:
+                shell.run(*command)
+            except ShellInterrupt:
+                shell.vars["?"] = "130"
+                self.send("^C\n")
+            except ShellExit:
+                return
+            self.send("quantenna # ")
+
+    def _read_command(self) -> Optional[Tuple[str, Optional[str]]]:
+        """Read and echo a command with its continuation lines and heredoc body
+
+        :return: (command text, heredoc body or None), None on disconnect
+        """
+        line = self.readline()
+        if line is None:
+            return None
+        self.send(f"{line}\n")
+        text = line
+        while text.endswith("\\"):
+            self.send("> ")
+            line = self.readline()
+            if line is None:
+                return None
+            self.send(f"{line}\n")
+            text = text[:-1] + line
+        heredoc = None
+        match = HEREDOC_RE.search(text)
+        if match:
+            body = []
+            while True:
+                self.send("> ")
+                line = self.readline()
+                if line is None:
+                    return None
+                self.send(f"{line}\n")
+                if line == match.group(1):
+                    break
+                body.append(line)
+            heredoc = "".join(f"{item}\n" for item in body)
+        return text, heredoc
+
+
+class QsrSimServer(socketserver.ThreadingTCPServer):
+    """TCP server holding the shared device state"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, config: QsrSimConfig):
+        self.state = QsrSimState(config)
+        self.sessions: Set[socket.socket] = set()
+        super().__init__((config.host, config.port), QsrSimHandler)
+
+    def server_close(self):
+        super().server_close()
+        for sock in list(self.sessions):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class QsrSimulator:
+    """Runs a QsrSimServer in a background thread
+
+    Usage:
+        with QsrSimulator(QsrSimConfig(latency_s=0.002)) as sim:
+            qsr = QsrMfg(sim.host, telnet_port=sim.port, shared=False)
+    """
+
+    def __init__(self, config: Optional[QsrSimConfig] = None):
+        self.config = config or QsrSimConfig()
+        self.server: Optional[QsrSimServer] = None
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def host(self) -> str:
+        """Address the simulator listens on"""
+        return self.server.server_address[0]
+
+    @property
+    def port(self) -> int:
+        """Port the simulator listens on"""
+        return self.server.server_address[1]
+
+    @property
+    def state(self) -> QsrSimState:
+        """Shared device state"""
+        return self.server.state
+
+    def start(self) -> "QsrSimulator":
+        """Start serving in a daemon thread"""
+        self.server = QsrSimServer(self.config)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving"""
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def __enter__(self) -> "QsrSimulator":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def parse_args():
+    """Argument Parser for Command Line Control"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2323)
+    parser.add_argument("--calstate", type=int, default=1)
+    parser.add_argument("--latency-ms", type=float, default=5.0)
+    parser.add_argument("--jitter-ms", type=float, default=2.0)
+    parser.add_argument("--seed", type=int, default=None)
+    return parser.parse_args()
+
+
+def main():
+    """Main Function for Command line compatibility"""
+    args = parse_args()
+    config = QsrSimConfig(
+        host=args.host,
+        port=args.port,
+        calstate=args.calstate,
+        latency_s=args.latency_ms / 1e3,
+        jitter_s=args.jitter_ms / 1e3,
+        seed=args.seed,
+    )
+    server = QsrSimServer(config)
+    print(f"QSR simulator listening on {args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Eight-chain RX characterisation from one show_test_packet capture
+
+show_test_packet reports RSSI for every chain at once, in ANT_MAP order. Each
+chain name is a polarization (V = SHF 0, H = SHF 1) and a path, so all eight
+paths are enabled on both boards and every chain is recorded from the same
+dump instead of measuring one path at a time.
+
+Usage:
+    python rx_chains.py --lo 19.6 --captures 10 --output rx_chains.csv
+"""
+import csv
+import time
+import logging
+import argparse
+from typing import Dict, Iterable, List, Tuple
+
+import tx_setup
+from qsr_mfg import QsrMfg
+from rx_stats import EVM_STREAMS, RxStats
+from utils import ANT_MAP
+
+POL_SHF_ID = {"V": 0, "H": 1}
+
+
+def chain_path(chain: str) -> Tuple[int, int]:
+    """(shf_id, path) of an ANT_MAP chain name, e.g. "H3" -> (1, 3)"""
+    return POL_SHF_ID[chain[0]], int(chain[1:])
+
+
+# (shf_id, path) of every RSSI entry of a show_test_packet dump
+CHAIN_PATHS = [chain_path(chain) for chain in ANT_MAP]
+
+
+def rx_set_chains(
+    bench: tx_setup.BenchSession,
+    chains: Iterable[str] = ANT_MAP,
+    lo_dsa: float = 10,
+):
+    """Enable the RX paths of the given chains on both boards
+
+    :param bench: session whose path shadow tracks the writes
+    :param chains: ANT_MAP names
+    :param lo_dsa: LO attenuation on every board used
+    """
+    paths = sorted({chain_path(chain) for chain in chains})
+    with bench.transaction() as trans:
+        for shf_id in sorted({shf_id for shf_id, _ in paths}):
+            trans.set_lo_atten(shf_id, lo_dsa)
+            trans.set_mode(shf_id, "rx")
+        for shf_id, path in paths:
+            trans.set_path(shf_id, path, mixer_enabled=True)
+
+
+def chain_rows(stats: RxStats, **extra) -> List[Dict]:
+    """One row per ANT_MAP chain from a single dump
+
+    EVM is reported per spatial stream, not per chain, so the EVM_STREAMS values
+    are repeated on every row.
+
+    :param stats: show_test_packet dump
+    :param extra: columns added to every row, e.g. capture index or LO frequency
+    """
+    evm = list(stats.evm) if stats.evm is not None else [None] * EVM_STREAMS
+    rows = []
+    for idx, chain in enumerate(ANT_MAP):
+        shf_id, path = CHAIN_PATHS[idx]
+        rows.append(
+            {
+                **extra,
+                "chain": chain,
+                "shf_id": shf_id,
+                "path": path,
+                "rssi": stats.rssi[idx] if stats.rssi is not None else None,
+                "mpdu_good": stats.mpdu_good,
+                "mpdu_crc": stats.mpdu_crc,
+                "per": stats.per,
+                **{f"evm_{col}": value for col, value in enumerate(evm)},
+            }
+        )
+    return rows
+
+
+def capture_chains(
+    qsr: QsrMfg, captures: int = 1, interval_s: float = 1.0
+) -> List[Dict]:
+    """Read show_test_packet captures times and return chain_rows() of each
+
+    :param qsr: QSR in test mode with the paths enabled, see rx_set_chains()
+    :param captures: number of dumps
+    :param interval_s: wait between dumps
+    """
+    logger = logging.getLogger(__name__)
+    rows = []
+    for capture in range(captures):
+        if capture:
+            time.sleep(interval_s)
+        stats = qsr.read_rx_stats()
+        logger.debug(f"Capture {capture}: RSSI {stats.rssi}")
+        rows.extend(chain_rows(stats, capture=capture))
+    return rows
+
+
+def save_rows(filename: str, rows: List[Dict]):
+    """Write chain rows as CSV"""
+    with open(filename, "w", newline="") as ofile:
+        writer = csv.DictWriter(ofile, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lo", type=float, required=True, help="LO frequency [GHz]")
+    parser.add_argument("--chains", nargs="+", default=ANT_MAP, choices=ANT_MAP)
+    parser.add_argument("--captures", type=int, default=1)
+    parser.add_argument("--interval", type=float, default=1.0)
+    parser.add_argument("--output", default="rx_chains.csv")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    with tx_setup.BenchSession() as bench:
+        bench.set_lo(args.lo)
+        rx_set_chains(bench, args.chains)
+        bench.qsr.set_test_mode()
+        rows = capture_chains(bench.qsr, args.captures, args.interval)
+    rows = [row for row in rows if row["chain"] in args.chains]
+    save_rows(args.output, rows)
+    for row in rows[-len(args.chains) :]:
+        print(f"{row['chain']} (shf {row['shf_id']} path {row['path']}): {row['rssi']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Columnar tables of every show_test_packet dump in a kernel log
+
+Usage:
+    python rx_log.py soak_dmesg.log --output soak_rx.csv
+    frame = rx_log_frame(qsr.dmesg())
+"""
+import argparse
+from typing import Dict, List
+
+try:
+    import numpy as np
+    import pandas as pd
+except ModuleNotFoundError:
+    print("Couldn't import numpy/pandas")
+
+from rx_stats import EVM_STREAMS, RxStats, iter_rx_blocks
+from utils import ANT_MAP
+
+# RxStats fields holding one number
+SCALAR_FIELDS = [key for key in RxStats._fields if key not in ("evm", "rssi")]
+
+
+def rx_log_columns(raw_output: str) -> Dict[str, "np.ndarray"]:
+    """One array per field with a row per dump; missing values are NaN
+
+    Columns: kernel_ts, the scalar RxStats fields, per (cumulative at the
+    dump), evm_0..evm_3 and one rssi_<chain> column per ANT_MAP chain.
+
+    :param raw_output: kernel log text, e.g. a dmesg capture
+    """
+    timestamps: List = []
+    records: List[RxStats] = []
+    for timestamp, stats in iter_rx_blocks(raw_output):
+        timestamps.append(timestamp)
+        records.append(stats)
+    columns = {"kernel_ts": np.array(timestamps, dtype=float)}
+    for key in SCALAR_FIELDS:
+        columns[key] = np.array([getattr(rec, key) for rec in records], dtype=float)
+    total = columns["mpdu_good"] + columns["mpdu_crc"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        columns["per"] = np.where(total > 0, columns["mpdu_crc"] / total, np.nan)
+    evm = np.full((len(records), EVM_STREAMS), np.nan)
+    rssi = np.full((len(records), len(ANT_MAP)), np.nan)
+    for row, rec in enumerate(records):
+        if rec.evm is not None:
+            evm[row] = rec.evm
+        if rec.rssi is not None:
+            rssi[row] = rec.rssi
+    for col in range(EVM_STREAMS):
+        columns[f"evm_{col}"] = evm[:, col]
+    for col, chain in enumerate(ANT_MAP):
+        columns[f"rssi_{chain}"] = rssi[:, col]
+    return columns
+
+
+def rx_log_frame(raw_output: str) -> "pd.DataFrame":
+    """rx_log_columns() as a DataFrame"""
+    return pd.DataFrame(rx_log_columns(raw_output))
+
+
+def read_rx_log(filename: str) -> "pd.DataFrame":
+    """rx_log_frame() of a saved kernel log file"""
+    with open(filename, "r", errors="replace") as ifile:
+        return rx_log_frame(ifile.read())
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("logs", nargs="+", help="saved dmesg / kernel log files")
+    parser.add_argument("--output", help="CSV file for the combined table")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    frames = []
+    for filename in args.logs:
+        frame = read_rx_log(filename)
+        frame.insert(0, "log", filename)
+        frames.append(frame)
+    table = pd.concat(frames, ignore_index=True)
+    if args.output:
+        table.to_csv(args.output, index=False)
+    print(f"{len(table)} show_test_packet dumps in {len(args.logs)} log(s)")
+    print(table.describe().T.to_string())
+
+
+if __name__ == "__main__":
+    main()
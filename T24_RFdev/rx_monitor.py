@@ -0,0 +1,209 @@
+"""Background RX statistics sampler backed by preallocated numpy arrays"""
+import time
+import logging
+import warnings
+import threading
+from typing import Callable, Dict, Optional
+
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    print("Couldn't import numpy")
+
+from rx_stats import EVM_STREAMS, RxStats
+from utils import ANT_MAP
+
+GAIN_FIELDS = ("rx_gain", "rgi", "elna")
+
+
+class RxRingBuffer:
+    """Fixed-size ring of RX samples stored column by column
+
+    rssi columns follow the chain order of the dump; chains[i] is the ANT_MAP
+    name of column i.
+    """
+
+    def __init__(self, capacity: int = 4096):
+        self.capacity = capacity
+        self.chains = list(ANT_MAP)
+        self.time = np.full(capacity, np.nan)
+        # float so that dumps without counters or gains are NaN, not 0
+        self.mpdu_good = np.full(capacity, np.nan)
+        self.mpdu_crc = np.full(capacity, np.nan)
+        self.evm = np.full((capacity, EVM_STREAMS), np.nan)
+        self.rssi = np.full((capacity, len(self.chains)), np.nan)
+        self.gain = np.full((capacity, len(GAIN_FIELDS)), np.nan)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return min(self.count, self.capacity)
+
+    def append(self, stats: RxStats):
+        """Store one dump, overwriting the oldest sample when full"""
+        with self._lock:
+            idx = self.count % self.capacity
+            self.time[idx] = time.monotonic()
+            self.mpdu_good[idx] = np.nan if stats.mpdu_good is None else stats.mpdu_good
+            self.mpdu_crc[idx] = np.nan if stats.mpdu_crc is None else stats.mpdu_crc
+            self.evm[idx] = np.nan if stats.evm is None else stats.evm
+            self.rssi[idx] = np.nan if stats.rssi is None else stats.rssi
+            self.gain[idx] = [
+                np.nan if getattr(stats, key) is None else getattr(stats, key)
+                for key in GAIN_FIELDS
+            ]
+            self.count += 1
+
+    def clear(self):
+        """Drop every sample"""
+        with self._lock:
+            self.count = 0
+
+    def _window(
+        self, seconds: Optional[float], samples: Optional[int]
+    ) -> "np.ndarray":
+        """Ring indices of the selected samples, oldest first"""
+        size = len(self)
+        if samples is not None:
+            size = min(size, samples)
+        idx = (self.count - size + np.arange(size)) % self.capacity
+        if seconds is not None and size:
+            idx = idx[self.time[idx] >= time.monotonic() - seconds]
+        return idx
+
+    def columns(
+        self, seconds: Optional[float] = None, samples: Optional[int] = None
+    ) -> Dict[str, "np.ndarray"]:
+        """Copy of the selected samples, oldest first
+
+        :param seconds: only samples taken in the last seconds
+        :param samples: only the newest samples
+        """
+        with self._lock:
+            idx = self._window(seconds, samples)
+            data = {
+                "time": self.time[idx],
+                "mpdu_good": self.mpdu_good[idx],
+                "mpdu_crc": self.mpdu_crc[idx],
+                "evm": self.evm[idx],
+                "rssi": self.rssi[idx],
+            }
+            for col, key in enumerate(GAIN_FIELDS):
+                data[key] = self.gain[idx, col]
+        return data
+
+    def summary(
+        self, seconds: Optional[float] = None, samples: Optional[int] = None
+    ) -> dict:
+        """Mean/std of EVM, RSSI and gain and the PER over a window
+
+        MPDU counters are cumulative on the QSR, so PER comes from the counter
+        increase between the first and last samples that have counters; if the
+        counters were reset inside the window the last totals are used instead.
+
+        :param seconds: only samples taken in the last seconds
+        :param samples: only the newest samples
+        """
+        data = self.columns(seconds, samples)
+        size = len(data["time"])
+        if not size:
+            return {"samples": 0}
+        counted = ~(np.isnan(data["mpdu_good"]) | np.isnan(data["mpdu_crc"]))
+        good_counts = data["mpdu_good"][counted]
+        crc_counts = data["mpdu_crc"][counted]
+        if not len(good_counts):
+            good = crc = None
+        else:
+            good = good_counts[-1] - good_counts[0]
+            crc = crc_counts[-1] - crc_counts[0]
+            if len(good_counts) == 1 or good < 0 or crc < 0:
+                good, crc = good_counts[-1], crc_counts[-1]
+            good, crc = int(good), int(crc)
+        total = (good or 0) + (crc or 0)
+        with warnings.catch_warnings():
+            # all-NaN columns (fields missing from every dump) give NaN
+            warnings.simplefilter("ignore", RuntimeWarning)
+            evm_mean = np.nanmean(data["evm"], axis=0)
+            evm_std = np.nanstd(data["evm"], axis=0)
+            rssi_mean = np.nanmean(data["rssi"], axis=0)
+            rssi_std = np.nanstd(data["rssi"], axis=0)
+            gain_mean = {key: np.nanmean(data[key]) for key in GAIN_FIELDS}
+        return {
+            "samples": size,
+            "duration_s": float(data["time"][-1] - data["time"][0]),
+            "mpdu_good": good,
+            "mpdu_crc": crc,
+            "per": float(crc / total) if total else None,
+            "evm_mean": evm_mean.round(3).tolist(),
+            "evm_std": evm_std.round(3).tolist(),
+            "rssi_mean": dict(zip(self.chains, rssi_mean.round(3).tolist())),
+            "rssi_std": dict(zip(self.chains, rssi_std.round(3).tolist())),
+            **{
+                f"{key}_mean": float(mean.round(3))
+                for key, mean in gain_mean.items()
+            },
+        }
+
+
+class RxMonitor:
+    """Samples RX statistics at a fixed rate in a background thread"""
+
+    def __init__(
+        self,
+        read: Callable[[], RxStats],
+        rate_hz: float = 10.0,
+        capacity: int = 4096,
+    ):
+        """
+        :param read: triggers and returns one show_test_packet dump
+        :param rate_hz: samples per second; slots that are missed are skipped
+        :param capacity: samples kept in the ring buffer
+        """
+        self.logger = logging.getLogger(__name__)
+        self.read = read
+        self.period = 1.0 / rate_hz
+        self.buffer = RxRingBuffer(capacity)
+        self.errors = 0
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        """True while the sampler thread is alive"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> "RxMonitor":
+        """Start sampling"""
+        if not self.running:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop sampling; the buffer is kept"""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def summary(
+        self, seconds: Optional[float] = None, samples: Optional[int] = None
+    ) -> dict:
+        """See RxRingBuffer.summary"""
+        return self.buffer.summary(seconds, samples)
+
+    def _run(self):
+        next_time = time.monotonic()
+        while not self._stopping.is_set():
+            try:
+                self.buffer.append(self.read())
+            except Exception as err:  # pylint: disable=broad-except
+                self.errors += 1
+                self.logger.warning(f"RX sample failed: {err!r}")
+            next_time += self.period
+            now = time.monotonic()
+            if next_time < now:
+                next_time += (now - next_time) // self.period * self.period
+                next_time += self.period
+            self._stopping.wait(next_time - now)
@@ -0,0 +1,178 @@
+"""RX sensitivity search: a signal generator drives the QSR, RX stats judge it
+
+The generator plays a WLAN waveform the QSR decodes in test mode; its power is
+bisected between a failing and a passing level until the bracket is narrower
+than the resolution, so N power steps cost about log2(N) captures. All eight
+chains are searched together: every capture is judged for each chain, and
+chains whose brackets are still identical share their captures.
+
+Usage:
+    from hw_qa_tools import visa_generator as SG
+    search = SensitivitySearch(QsrMfg(), SG.SignalGenerator("10.13.23.77"))
+    results = search.run(lo_dbm=-95, hi_dbm=-40, resolution_db=0.5)
+"""
+import time
+import logging
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, NamedTuple, Optional
+
+from qsr_mfg import QsrMfg
+from rx_stats import RxStats
+from utils import ANT_MAP
+
+
+class RxCapture(NamedTuple):
+    """RX statistics read at one power level"""
+
+    power_dbm: float  # at the QSR input
+    per: Optional[float]  # over the dwell only
+    stats: RxStats  # dump at the end of the dwell
+
+
+def per_below(limit: float) -> Callable[[RxCapture, int], bool]:
+    """Pass when the PER over the dwell is at most limit (same for all chains)"""
+
+    def passes(capture: RxCapture, chain: int) -> bool:
+        return capture.per is not None and capture.per <= limit
+
+    return passes
+
+
+def rssi_above(limit_dbm: float) -> Callable[[RxCapture, int], bool]:
+    """Pass when the chain's RSSI is at least limit_dbm"""
+
+    def passes(capture: RxCapture, chain: int) -> bool:
+        rssi = capture.stats.rssi
+        return rssi is not None and rssi[chain] >= limit_dbm
+
+    return passes
+
+
+@dataclass
+class ChainSensitivity:
+    """Search result for one chain"""
+
+    chain: str  # ANT_MAP name
+    sensitivity_dbm: Optional[float]  # lowest passing power, None if none passed
+    fail_dbm: Optional[float]  # highest failing power, None if all passed
+    captures: int  # captures judged for this chain
+
+
+class SensitivitySearch:
+    """Bisects generator power for a pass/fail threshold on every chain"""
+
+    def __init__(
+        self,
+        qsr: QsrMfg,
+        generator,
+        passes: Callable[[RxCapture, int], bool] = per_below(0.1),
+        settle_s: float = 0.2,
+        dwell_s: float = 1.0,
+        cable_loss_db: float = 0.0,
+    ):
+        """
+        :param qsr: QSR in test mode, receiving the generator's waveform
+        :param generator: source with set_amplitude(dBm), e.g. SG.SignalGenerator
+        :param passes: passes(capture, chain index) -> bool; must be monotonic
+            in power
+        :param settle_s: wait after changing power
+        :param dwell_s: time the MPDU counters are accumulated over
+        :param cable_loss_db: loss from generator to QSR input
+        """
+        self.logger = logging.getLogger(__name__)
+        self.qsr = qsr
+        self.generator = generator
+        self.passes = passes
+        self.settle_s = settle_s
+        self.dwell_s = dwell_s
+        self.cable_loss_db = cable_loss_db
+        self.captures: Dict[float, RxCapture] = {}
+
+    def capture(self, power_dbm: float) -> RxCapture:
+        """Set power_dbm at the QSR input and read RX stats over one dwell"""
+        power_dbm = round(power_dbm, 3)
+        if power_dbm in self.captures:
+            return self.captures[power_dbm]
+        self.generator.set_amplitude(power_dbm + self.cable_loss_db)
+        time.sleep(self.settle_s)
+        first = self.qsr.read_rx_stats()
+        time.sleep(self.dwell_s)
+        last = self.qsr.read_rx_stats()
+        per = None
+        counts = last.counts_since(first)
+        if counts is not None and sum(counts):
+            per = counts[1] / sum(counts)
+        capture = RxCapture(power_dbm, per, last)
+        self.captures[power_dbm] = capture
+        self.logger.debug(f"RX capture at {power_dbm} dBm: PER {per}")
+        return capture
+
+    def run(
+        self,
+        lo_dbm: float = -100.0,
+        hi_dbm: float = -40.0,
+        resolution_db: float = 0.5,
+        chains: Iterable[int] = range(len(ANT_MAP)),
+    ) -> Dict[str, ChainSensitivity]:
+        """Find the lowest passing power of every chain within resolution_db
+
+        :param lo_dbm: bottom of the search range (expected to fail)
+        :param hi_dbm: top of the search range (expected to pass)
+        :param resolution_db: stop once a chain's bracket is this narrow; test
+            powers are snapped to this grid above lo_dbm so chains can share
+        :param chains: indices into ANT_MAP
+        :return: {ANT_MAP name: ChainSensitivity}
+        """
+        chains = list(chains)
+        self.captures = {}
+        counts = {chain: 2 for chain in chains}
+        # powers are integer steps of the grid; the top step is hi_dbm itself
+        top = round((hi_dbm - lo_dbm) / resolution_db)
+
+        def power(step: int) -> float:
+            return hi_dbm if step == top else lo_dbm + step * resolution_db
+
+        # bracket per chain: (highest failing, lowest passing) step; None = unbounded
+        low, high = self.capture(lo_dbm), self.capture(hi_dbm)
+        brackets = {}
+        for chain in chains:
+            if self.passes(low, chain):
+                brackets[chain] = (None, 0)
+            elif not self.passes(high, chain):
+                brackets[chain] = (top, None)
+            else:
+                brackets[chain] = (0, top)
+
+        def open_brackets():
+            return {
+                chain: (fail, ok)
+                for chain, (fail, ok) in brackets.items()
+                if fail is not None and ok is not None and ok - fail > 1
+            }
+
+        pending = open_brackets()
+        while pending:
+            for chain, (fail, ok) in pending.items():
+                step = (fail + ok) // 2
+                capture = self.capture(power(step))
+                counts[chain] += 1
+                if self.passes(capture, chain):
+                    brackets[chain] = (fail, step)
+                else:
+                    brackets[chain] = (step, ok)
+            pending = open_brackets()
+
+        results = {}
+        for chain in chains:
+            fail, ok = brackets[chain]
+            results[ANT_MAP[chain]] = ChainSensitivity(
+                ANT_MAP[chain],
+                power(ok) if ok is not None else None,
+                power(fail) if fail is not None else None,
+                counts[chain],
+            )
+        self.logger.info(
+            f"Sensitivity search used {len(self.captures)} captures for "
+            f"{len(chains)} chains"
+        )
+        return results
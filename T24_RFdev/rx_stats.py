@@ -0,0 +1,220 @@
+"""Parsers for the RX statistics dumped by show_test_packet"""
+import re
+import logging
+from typing import Iterator, NamedTuple, Optional, Tuple
+
+# Kept for callers that match single fields; the parser below uses RX_LINE_RE
+SEARCH_PARAMS = {
+    "packets": r"(?:\[[0-9.]+ )?MPDU_GOOD = (\d+); MPDU_CRC = (\d+)",
+    "rate": r"(?:\[[0-9.]+ )?MCS = (?P<mcs>\d+); RX_SYMBOL_NUM = (?P<rx_sym_num>\d+); "
+    r"NSTS = (?P<nsts>\d+); BW = (?P<bandwidth>\d+); FORMAT = (?P<format>\d+)",
+    "ru": r"(?:\[[0-9.]+ )?RU_Size = (?P<ru_size>\d+); RU_Indx = (?P<ru_index>\d+);  "
+    r"SIGB_MCS = (?P<sigB_mcs>\d+);  GI_LTF = (?P<gi_ltf>\d+)",
+    "he_ltf": r"(?:\[[0-9.]+ )?Num_SIGB = (?P<num_sigB>\d+); Num_HE_LTF = (?P<num_he_ltf>\d+); "
+    r"STA_ID = (?P<sta_id>\d+);  TPE = (?P<TPE>\d+); A_fcator = (?P<a_factor>\d+); "
+    r"Disambiguity = (?P<disambiguity>\d+)",
+    "gain": r"(?:\[[0-9.]+ )?RX_GAIN = (?P<rx_gain>\d+); rgi = (?P<rgi>\d+); elna = (?P<elna>\d+)",
+    "rssi": r"(?:\[[0-9.]+ )?RX_RSSI_dBm  : (-?\d+\.\d+), (-?\d+\.\d+), (-?\d+\.\d+), "
+    r"(-?\d+\.\d+), (-?\d+\.\d+), (-?\d+\.\d+), (-?\d+\.\d+), (-?\d+\.\d+)",
+    "evm": r"(?:\[[0-9.]+ )?EVM_AVG : (-?\d+\.\d+), ( ?-?\d+\.\d+), ( ?-?\d+\.\d+), ( ?-?\d+\.\d+)",
+}
+
+
+_FLOAT = r"(-?\d+\.\d+)"
+# (group, pattern, fields) for every line of a show_test_packet dump
+RX_LINES = (
+    ("packets", r"MPDU_GOOD = (\d+); MPDU_CRC = (\d+)", ("mpdu_good", "mpdu_crc")),
+    (
+        "rate",
+        r"MCS = (\d+); RX_SYMBOL_NUM = (\d+); NSTS = (\d+); BW = (\d+); "
+        r"FORMAT = (\d+)",
+        ("mcs", "rx_sym_num", "nsts", "bandwidth", "format"),
+    ),
+    (
+        "ru",
+        r"RU_Size = (\d+); RU_Indx = (\d+);  SIGB_MCS = (\d+);  GI_LTF = (\d+)",
+        ("ru_size", "ru_index", "sigB_mcs", "gi_ltf"),
+    ),
+    (
+        "he_ltf",
+        r"Num_SIGB = (\d+); Num_HE_LTF = (\d+); STA_ID = (\d+);  TPE = (\d+); "
+        r"A_fcator = (\d+); Disambiguity = (\d+)",
+        ("num_sigB", "num_he_ltf", "sta_id", "TPE", "a_factor", "disambiguity"),
+    ),
+    (
+        "gain",
+        r"RX_GAIN = (\d+); rgi = (\d+); elna = (\d+)",
+        ("rx_gain", "rgi", "elna"),
+    ),
+    ("rssi", r"RX_RSSI_dBm  : " + ", ".join([_FLOAT] * 8), ("rssi",)),
+    ("evm", r"EVM_AVG : " + ",  ?".join([_FLOAT] * 4), ("evm",)),
+)
+# One alternation over every line type, so a dump is scanned once
+RX_LINE_RE = re.compile(
+    "|".join(f"(?P<{group}>{pattern})" for group, pattern, _ in RX_LINES)
+)
+# Index of each group's first field in RX_LINE_RE and its field count
+_GROUP_SPANS = {
+    group: (RX_LINE_RE.groupindex[group] + 1, re.compile(pattern).groups)
+    for group, pattern, _ in RX_LINES
+}
+_GROUP_FIELDS = {group: fields for group, _, fields in RX_LINES}
+EVM_STREAMS = 4
+# First and last line of a show_test_packet dump
+RX_BLOCK_START = "MPDU_GOOD = "
+RX_BLOCK_END = "EVM_AVG : "
+# Optional <level> and [timestamp] prefixes of a kernel log line
+KMSG_PREFIX_RE = re.compile(r"(?:<\d+>)?(?:\[\s*(\d+\.\d+)\]?\s?)?")
+
+
+class RxStats(NamedTuple):
+    """One show_test_packet dump; fields that were not found are None"""
+
+    mpdu_good: Optional[int] = None
+    mpdu_crc: Optional[int] = None
+    evm: Optional[Tuple[float, ...]] = None
+    rssi: Optional[Tuple[float, ...]] = None
+    mcs: Optional[int] = None
+    rx_sym_num: Optional[int] = None
+    nsts: Optional[int] = None
+    bandwidth: Optional[int] = None  # MHz
+    format: Optional[int] = None
+    ru_size: Optional[int] = None
+    ru_index: Optional[int] = None
+    sigB_mcs: Optional[int] = None
+    gi_ltf: Optional[int] = None
+    num_sigB: Optional[int] = None
+    num_he_ltf: Optional[int] = None
+    sta_id: Optional[int] = None
+    TPE: Optional[int] = None
+    a_factor: Optional[int] = None
+    disambiguity: Optional[int] = None
+    rx_gain: Optional[int] = None
+    rgi: Optional[int] = None
+    elna: Optional[int] = None
+
+    @property
+    def per(self) -> Optional[float]:
+        """Packet error rate, None without packet counts"""
+        if self.mpdu_good is None or self.mpdu_crc is None:
+            return None
+        total = self.mpdu_good + self.mpdu_crc
+        return self.mpdu_crc / total if total else None
+
+    def counts_since(self, first: "RxStats") -> Optional[Tuple[int, int]]:
+        """(good, crc) MPDUs received since the dump first
+
+        The counters are cumulative; if they were reset in between, this dump's
+        totals are used. None if either dump has no counters.
+        """
+        if self.mpdu_good is None or first.mpdu_good is None:
+            return None
+        good = self.mpdu_good - first.mpdu_good
+        crc = self.mpdu_crc - first.mpdu_crc
+        if good < 0 or crc < 0:
+            return self.mpdu_good, self.mpdu_crc
+        return good, crc
+
+    def to_dict(self) -> dict:
+        """Same layout as the rx_params dict returned by show_test_packet"""
+        rx_params = {}
+        if self.mpdu_good is not None:
+            rx_params["rf_rx"] = [self.mpdu_good, self.mpdu_crc]
+        if self.evm is not None:
+            rx_params["evm"] = list(self.evm)
+        if self.rssi is not None:
+            rx_params["rssi"] = list(self.rssi)
+        for key in self._fields[4:]:
+            value = getattr(self, key)
+            if value is not None:
+                rx_params[key] = value
+        return rx_params
+
+
+def _scan(raw_output: str, pos: int, endpos: int, found: dict):
+    """Add the first match of every line type in raw_output[pos:endpos]"""
+    for match in RX_LINE_RE.finditer(raw_output, pos, endpos):
+        group = match.lastgroup
+        if group in found:
+            continue
+        first, count = _GROUP_SPANS[group]
+        values = match.group(*range(first, first + count))
+        if count == 1:
+            values = (values,)
+        if group in ("rssi", "evm"):
+            found[group] = {group: tuple(map(float, values))}
+        else:
+            found[group] = dict(zip(_GROUP_FIELDS[group], map(int, values)))
+        if len(found) == len(RX_LINES):
+            return
+
+
+def parse_rx_stats(raw_output: str) -> RxStats:
+    """Parse the first show_test_packet dump in raw_output
+
+    The dump is located with a plain substring search and only its lines go
+    through RX_LINE_RE; the rest of the log is scanned only if lines are
+    missing from it.
+
+    :param raw_output: kernel log text holding a show_test_packet dump
+    """
+    found: dict = {}
+    start = raw_output.find(RX_BLOCK_START)
+    pos = raw_output.rfind("\n", 0, start) + 1 if start > 0 else 0
+    _scan(raw_output, pos, len(raw_output), found)
+    if len(found) < len(RX_LINES) and pos:
+        earlier: dict = {}
+        _scan(raw_output, 0, pos, earlier)
+        found.update(earlier)
+    return _to_record(found)
+
+
+def _to_record(found: dict) -> RxStats:
+    fields = {}
+    for values in found.values():
+        fields.update(values)
+    if "bandwidth" in fields:
+        fields["bandwidth"] = 20 * (2 ** fields["bandwidth"])
+    return RxStats(**fields)
+
+
+def kernel_timestamp(raw_output: str, pos: int) -> Optional[float]:
+    """[ts] prefix of the kernel log line holding position pos, if any"""
+    prefix = KMSG_PREFIX_RE.match(raw_output, raw_output.rfind("\n", 0, pos) + 1)
+    return float(prefix.group(1)) if prefix.group(1) else None
+
+
+def iter_rx_blocks(raw_output: str) -> Iterator[Tuple[Optional[float], RxStats]]:
+    """Yield (kernel timestamp, RxStats) for every show_test_packet dump
+
+    Dumps are found with substring searches and each one is scanned up to the
+    start of the next, so the cost grows with the number of dumps rather than
+    with the size of the log.
+
+    :param raw_output: kernel log text, e.g. a dmesg capture of a soak test
+    """
+    start = raw_output.find(RX_BLOCK_START)
+    while start >= 0:
+        nxt = raw_output.find(RX_BLOCK_START, start + len(RX_BLOCK_START))
+        found: dict = {}
+        _scan(raw_output, start, len(raw_output) if nxt < 0 else nxt, found)
+        yield kernel_timestamp(raw_output, start), _to_record(found)
+        start = nxt
+
+
+def parse_rx_params(raw_output: str, logger: logging.Logger) -> dict:
+    """Parse show_test_packet output from dmesg
+
+    :param raw_output: kernel log text holding a show_test_packet dump
+    :param logger: logger for parse failures
+    """
+    stats = parse_rx_stats(raw_output)
+    if stats.mpdu_good is None:
+        logger.error("Could not parse RX packet numbers")
+    if stats.evm is None:
+        logger.error("Could not parse RX EVM")
+    if stats.rssi is None:
+        logger.error("Could not parse RX RSSI")
+    if None in (stats.mcs, stats.ru_size, stats.num_sigB, stats.rx_gain):
+        logger.error("Could not parse additional RX parameters")
+    return stats.to_dict()
@@ -1,13 +1,53 @@
 """This module manages the connection to the QSR"""
+import os
+import re
+import gzip
 import time
+import uuid
+import shlex
+import shutil
 import socket
+import hashlib
+import tarfile
+import tempfile
+import atexit
 import logging
-from typing import Optional, Union
-from telnetlib import Telnet
-from subprocess import check_output
+import itertools
+import threading
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    Iterable,
+    List,
+    Optional,
+    Pattern,
+    Set,
+    Tuple,
+    Union,
+)
+from pathlib import Path
 from dataclasses import dataclass, asdict
 
 from utils import DEFAULT_QSR_IP
+from s4_metrics import S4_METRICS, S4Metrics, batch_type
+from telnet_socket import TelnetSocket
+from tftp_server import TftpServer, get_tftp_server
+
+# Read-only call_qcsapi queries that may be cached: {subcommand: ttl in s}
+# A ttl of None keeps the result until a write invalidates it or we reconnect
+QCSAPI_QUERY_TTL = {
+    "get_bootcfg_param": None,
+    "get_firmware_version": None,
+    "get_mac_addr": None,
+}
+# call_qcsapi writes and the cached queries they make stale
+QCSAPI_INVALIDATES = {
+    "update_bootcfg_param": ("get_bootcfg_param",),
+    "set_mac_addr": ("get_mac_addr",),
+}
+QCSAPI_CALL_RE = re.compile(r"\bcall_qcsapi\s+(\S+)")
 
 
 @dataclass  # pylint: disable=too-many-instance-attributes  # dataclass
@@ -22,6 +62,7 @@ class S4ConnectClientConfig:
     login_prompt: str = "soc1 login: "
     bash_prompt: str = "quantenna # "
     trig: str = "==ENDOFRESPONSE==EXITCODE:"
+    batch_trig: str = "==ENDOFRESPONSE=={seq}==EXITCODE:"
 
 
 @dataclass
@@ -29,8 +70,11 @@ class S4ConnectServerConfig:
     """Configuration for S4Connect"""
 
     hostname: Optional[str] = None
-    tftp_root = "/var/lib/tftpboot"
-    tftp_linkname = "qsr_upload_file"
+    tftp_bind: str = "0.0.0.0"
+    tftp_port: int = 6969
+    tftp_blksize: Optional[int] = None  # needs busybox tftp with -b support
+    tftp_timeout: float = 60
+    qsr_staging_dir: str = "/tmp"
     logger = logging.getLogger(__name__)
 
     def __post_init__(self):
@@ -42,13 +86,158 @@ class S4ConnectServerConfig:
                 self.logger.debug("Could not Autodetect Server IP")
 
 
+@dataclass
+class BatchStep:
+    """Result of one command run by S4Connect.run_batch"""
+
+    command: str
+    output: str
+    status: int
+
+
+BATCH_STEP_MARK = "==S4STEP=={idx}==EXITCODE:"
+BATCH_STEP_RE = re.compile(r"==S4STEP==(\d+)==EXITCODE:(-?\d+)")
+BATCH_EOF = "S4EOF"
+# Echoed after an interrupted stream; typed as S4""SYNC so only the output matches
+STREAM_SYNC = "S4SYNC{seq}"
+STDIN_PROMPTS = ("> ", "quantenna # ")
+
+
+def file_md5(filename: str) -> str:
+    """md5 hex digest of a local file"""
+    digest = hashlib.md5()
+    with open(filename, "rb") as ifile:
+        for chunk in iter(lambda: ifile.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def line_is_stdin(line: str) -> bool:
+    """Check if the incoming line is part of stdin"""
+    return line.startswith(STDIN_PROMPTS)
+
+
+def strip_echo(raw: str, echoed: Set[str]) -> str:
+    """Remove prompts and echoed input lines from raw shell output
+
+    Depending on how the shell echoes, a prompt may be printed in front of
+    real output, so prompts are stripped and only echoed input is dropped.
+
+    :param raw: raw text read from the session
+    :param echoed: input lines that were sent
+    """
+    lines = []
+    for line in raw.splitlines(keepends=True):
+        prompted = False
+        while line.startswith(STDIN_PROMPTS):
+            line = line[len(next(p for p in STDIN_PROMPTS if line.startswith(p))) :]
+            prompted = True
+        if line.strip() in echoed or (prompted and not line.strip()):
+            continue
+        lines.append(line)
+    return "".join(lines).strip()
+
+
+def batch_payload(cmds: List[str], tags: List[str], newline: str) -> str:
+    """Build the text for a batch where each command echoes its own trigger"""
+    return "".join(
+        f"{cmd};\\{newline}echo {tag}$?{newline}" for cmd, tag in zip(cmds, tags)
+    )
+
+
+def batch_end(tags: List[str], newline: str) -> Pattern[bytes]:
+    """Regex for the trigger line that ends a batch"""
+    return re.compile(f"{re.escape(tags[-1])}-?\\d+{newline}".encode())
+
+
+def demux_batch(
+    raw: str, cmds: List[str], tags: List[str]
+) -> List[Optional[Tuple[str, int]]]:
+    """Split the raw output of a batch into per-command responses
+
+    Each response is taken from after the command's echoed "echo <tag>$?" line,
+    so echoed input is skipped even when the terminal wrapped or decorated it.
+
+    :param raw: everything read up to the last trigger
+    :param cmds: commands in the batch
+    :param tags: trigger used by each command
+    :return: (response, exit code) per command, None if its trigger is missing
+    """
+    echoed = {f"{cmd};\\" for cmd in cmds} | {f"echo {tag}$?" for tag in tags}
+    results = []
+    start = 0
+    for tag in tags:
+        echo = raw.find(f"echo {tag}$?", start)
+        if echo >= 0:
+            start = raw.find("\n", echo) + 1 or len(raw)
+        match = re.compile(f"{re.escape(tag)}(-?\\d+)").search(raw, start)
+        if match is None:
+            results.append(None)
+            continue
+        outpt = strip_echo(raw[start : match.start()], echoed)
+        start = match.end()
+        results.append((outpt, int(match.group(1))))
+    return results
+
+
+class QueryCache:
+    """Results of read-only QSR queries with per-entry expiry"""
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[str, float]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, command: str) -> Optional[str]:
+        """Return the cached result, or None on a miss"""
+        entry = self._entries.get(command)
+        if entry is not None and entry[1] > time.monotonic():
+            self.hits += 1
+            return entry[0]
+        self._entries.pop(command, None)
+        self.misses += 1
+        return None
+
+    def put(self, command: str, result: str, ttl: Optional[float] = None):
+        """Cache a result for ttl seconds (None = until invalidated)"""
+        expires = float("inf") if ttl is None else time.monotonic() + ttl
+        self._entries[command] = (result, expires)
+
+    def invalidate(self, prefixes: Optional[Iterable[str]] = None):
+        """Drop entries whose command starts with any prefix; all if None"""
+        if prefixes is None:
+            self._entries.clear()
+            return
+        prefixes = tuple(prefixes)
+        for command in [cmd for cmd in self._entries if cmd.startswith(prefixes)]:
+            del self._entries[command]
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters and number of live entries"""
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
 class S4Connect:
     """This class sets up a persistent Telnet connection to the QSR"""
 
-    def __init__(self, client_config, server_config=None, autostart=False):
+    def __init__(
+        self,
+        client_config,
+        server_config=None,
+        autostart=False,
+        metrics: Optional[S4Metrics] = None,
+    ):
         self.logger = logging.getLogger(__name__)
+        self.metrics = S4_METRICS if metrics is None else metrics
         self.client_config = S4ConnectClientConfig(**client_config)
-        self.server_config = S4ConnectServerConfig(**server_config)
+        self.server_config = S4ConnectServerConfig(**(server_config or {}))
+        self._batch_seq = itertools.count()
+        # sessions can be shared through SESSION_POOL; one exchange at a time
+        self._lock = threading.RLock()
+        self.query_ttl = dict(QCSAPI_QUERY_TTL)
+        self.query_cache = QueryCache()
+        # last state applied to the device over this session, by owner
+        self.device_state: Dict[str, Any] = {}
         if autostart:
             self.conn = self.establish_connection()
         else:
@@ -56,7 +245,7 @@ class S4Connect:
 
     def establish_connection(self):
         """Establish Telnet connection to QSR"""
-        conn = Telnet(
+        conn = TelnetSocket(
             self.client_config.hostname, self.client_config.telnet_port, timeout=2
         )
         conn.read_until(self.client_config.login_prompt.encode())
@@ -64,6 +253,9 @@ class S4Connect:
             f"{self.client_config.username}{self.client_config.newline}".encode()
         )
         conn.read_until(self.client_config.bash_prompt.encode())
+        # a new session may follow a reboot, so nothing cached still holds
+        self.query_cache.invalidate()
+        self.device_state.clear()
         return conn
 
     def check_for_conn(self):
@@ -71,13 +263,54 @@ class S4Connect:
         if self.conn is None:
             self.conn = self.establish_connection()
 
-    def call_qcsapi(self, command: str):
+    def traffic(self) -> Tuple[int, int]:
+        """(bytes_in, bytes_out) of the current connection"""
+        if self.conn is None:
+            return 0, 0
+        return self.conn.bytes_in, self.conn.bytes_out
+
+    def is_alive(self) -> bool:
+        """Check that the Telnet session is open, discarding any stale output"""
+        if self.conn is None:
+            return False
+        with self._lock:
+            try:
+                self.conn.read_very_eager()
+            except (EOFError, OSError):
+                return False
+        return not self.conn.eof
+
+    def call_qcsapi(self, command: str, cached: bool = True):
         """Run call_qcsapi command
 
+        Queries listed in query_ttl are answered from query_cache while valid.
+
         :param command: qcsapi command to run
+        :param cached: allow a cached result for read-only queries; False
+            always asks the QSR and refreshes the cache
         """
         self.check_for_conn()
-        return self.communicate_trig(f"call_qcsapi {command}")[0]
+        command = command.strip()
+        name = command.split(maxsplit=1)[0]
+        if cached and name in self.query_ttl:
+            result = self.query_cache.get(command)
+            if result is not None:
+                return result
+        outpt, status = self.communicate_trig(f"call_qcsapi {command}")
+        if name in self.query_ttl and not status and outpt:
+            self.query_cache.put(command, outpt, self.query_ttl[name])
+        return outpt
+
+    def _invalidate_queries(self, cmds: Iterable[str]):
+        """Drop the cached queries made stale by call_qcsapi writes in cmds
+
+        Called by everything that sends command lines, so writes issued through
+        communicate_trig(), communicate_many() or run_batch() are seen too.
+        """
+        for cmd in cmds:
+            for match in QCSAPI_CALL_RE.finditer(cmd):
+                if match.group(1) in QCSAPI_INVALIDATES:
+                    self.query_cache.invalidate(QCSAPI_INVALIDATES[match.group(1)])
 
     def starry_moac(self, command: str):
         """Run starry_moac command
@@ -91,8 +324,10 @@ class S4Connect:
 
         :param max_retries: maximum number of times to try to get valid output
         """
-        for _ in range(max_retries):
-            calstate = self.call_qcsapi("get_bootcfg_param calstate")
+        for attempt in range(max_retries):
+            calstate = self.call_qcsapi(
+                "get_bootcfg_param calstate", cached=attempt == 0
+            )
             try:
                 calstate = int(calstate)
             except ValueError:
@@ -127,12 +362,7 @@ class S4Connect:
     @staticmethod
     def line_is_stdin(line):
         """Check if the incoming line is part of stdin"""
-        is_stdin = False
-        if line.startswith("> "):
-            is_stdin = True
-        if line.startswith("quantenna # "):
-            is_stdin = True
-        return is_stdin
+        return line_is_stdin(line)
 
     def readline(self):
         """Read one line from Telnet output buffer"""
@@ -156,83 +386,470 @@ class S4Connect:
             self.conn.close()
 
     def communicate(self, cmd, trig=None, wait=0, throttle=0.1):
-        """Send command and return response"""
-        self.readall()
-        self.write(cmd.strip() + self.client_config.newline)
-        if trig:
-            self.check_for_conn()
-            self.conn.read_until(f"{trig}$?{self.client_config.newline}".encode())
-            outpt = ""
-            done = False
-            while not done:
-                line = self.readline()
-                if line:
-                    outpt += line
-                    if trig.strip() in line:
-                        done = True
-                else:
-                    time.sleep(throttle)
-            return outpt
-        time.sleep(wait)
-        return self.readall()
+        """Send command and return response
+
+        With a trigger, returns as soon as the trigger line arrives.
+        throttle is no longer used and is kept for compatibility.
+        """
+        with self._lock:
+            self.readall()
+            self.write(cmd.strip() + self.client_config.newline)
+            if trig:
+                self.check_for_conn()
+                newline = self.client_config.newline
+                self.conn.read_until(f"{trig}$?{newline}".encode())
+                end = re.compile(f"{re.escape(trig.strip())}.*{newline}".encode())
+                outpt = self.conn.read_until(end).decode()
+                return "".join(
+                    line
+                    for line in outpt.splitlines(keepends=True)
+                    if not self.line_is_stdin(line)
+                )
+            time.sleep(wait)
+            return self.readall()
 
     def communicate_trig(self, cmd, max_retries: int = 5):
         """Send command using a trigger and return response and status"""
-        for _ in range(max_retries):
-            outpt = self.communicate(
-                f"{cmd.strip()};\\{self.client_config.newline}echo {self.client_config.trig}$?",
-                trig=self.client_config.trig,
-            )
-            outpt, status = outpt.split(self.client_config.trig)
-            try:
-                status = int(status)
-            except ValueError:
-                self.logger.debug(
-                    f"S4 failed to parse QSR command: {cmd} (bad status: '{status}')"
-                )
-                continue
-            if not outpt:
-                self.logger.debug(
-                    f"S4 failed to parse QSR command: {cmd} (bad output: '{outpt}')"
+        self.check_for_conn()
+        with self.metrics.timed(cmd, self.traffic):
+            for attempt in range(max_retries):
+                if attempt:
+                    self.metrics.retry(cmd)
+                outpt = self.communicate(
+                    f"{cmd.strip()};\\{self.client_config.newline}echo {self.client_config.trig}$?",
+                    trig=self.client_config.trig,
                 )
-                continue
-            break
+                outpt, status = outpt.split(self.client_config.trig)
+                try:
+                    status = int(status)
+                except ValueError:
+                    self.metrics.parse_failure(cmd)
+                    self.logger.debug(
+                        f"S4 failed to parse QSR command: {cmd} "
+                        f"(bad status: '{status}')"
+                    )
+                    continue
+                if not outpt:
+                    self.metrics.parse_failure(cmd)
+                    self.logger.debug(
+                        f"S4 failed to parse QSR command: {cmd} (bad output: '{outpt}')"
+                    )
+                    continue
+                break
+        self._invalidate_queries([cmd])
         if status:
             self.logger.error(f"QSR Command FAILED with exit code {status}: {cmd}")
         return outpt.strip(), status
 
-    def download_file(self, filename_server, filename_qsr):
-        """Download a file or directory from the QSR via TFTP"""
-        check_output("systemctl restart tftp".split())
-        check_output(
-            f"rm -f {self.server_config.tftp_root}/{self.server_config.tftp_linkname}".split()
-        )
-        self.communicate_trig(
-            f"tftp -p -r {self.server_config.tftp_linkname} -l {filename_qsr} "
-            f"{self.server_config.hostname}"
-        )
-        check_output(
-            f"cp {self.server_config.tftp_root}/{self.server_config.tftp_linkname} "
-            f"{filename_server}".split()
-        )
-        check_output(
-            f"rm -f {self.server_config.tftp_root}/{self.server_config.tftp_linkname}".split()
-        )
+    def communicate_many(
+        self, cmds: List[str], max_retries: int = 5
+    ) -> List[Tuple[str, int]]:
+        """Send several commands in a single write and return their responses
 
-    def upload_file(self, filename_server, filename_qsr):
-        """Upload a file or directory to the QSR via TFTP"""
-        check_output("systemctl restart tftp".split())
-        check_output(
-            f"rm -f {self.server_config.tftp_root}/{self.server_config.tftp_linkname}".split()
-        )
-        check_output(
-            f"cp {filename_server} "
-            f"{self.server_config.tftp_root}/{self.server_config.tftp_linkname}".split()
-        )
-        self.communicate_trig(
-            f"tftp -g -r {self.server_config.tftp_linkname} -l {filename_qsr} "
-            f"{self.server_config.hostname}"
+        Each command is tagged with its own sequence trigger, so the whole batch
+        costs one round trip. Commands whose response can't be demultiplexed are
+        re-sent on their own through communicate_trig.
+
+        :param cmds: commands to run, in order
+        :param max_retries: retries for commands that have to be re-sent
+        :return: list of (response, exit code) in the same order as cmds
+        """
+        cmds = [cmd.strip() for cmd in cmds]
+        if not cmds:
+            return []
+        tags = [
+            self.client_config.batch_trig.format(seq=next(self._batch_seq))
+            for _ in cmds
+        ]
+        self.check_for_conn()
+        key = batch_type(cmds)
+        with self._lock, self.metrics.timed(cmds[0], self.traffic, key):
+            self.readall()
+            self.write(batch_payload(cmds, tags, self.client_config.newline))
+            raw = self.conn.read_until(batch_end(tags, self.client_config.newline))
+        self._invalidate_queries(cmds)
+
+        results = []
+        for cmd, result in zip(cmds, demux_batch(raw.decode(), cmds, tags)):
+            if result is None:
+                self.metrics.parse_failure(cmd)
+                self.logger.debug(f"S4 failed to parse QSR command: {cmd} (no trigger)")
+                result = self.communicate_trig(cmd, max_retries=max_retries)
+            elif result[1]:
+                self.logger.error(
+                    f"QSR Command FAILED with exit code {result[1]}: {cmd}"
+                )
+            results.append(result)
+        return results
+
+    def stream(
+        self, cmd: str, timeout: Optional[float] = None
+    ) -> Generator[str, None, Optional[int]]:
+        """Run a command and yield its output lines as they arrive
+
+        Nothing is gathered, so long outputs (big dmesg dumps, cat /proc/kmsg)
+        can be parsed incrementally. The session stays locked until the
+        generator is exhausted or closed; closing it early stops the command
+        with Ctrl-C and resyncs the shell. Close it from the thread that
+        started it, e.g. with contextlib.closing().
+
+        :param cmd: command to run
+        :param timeout: seconds to wait for each chunk of output, None waits
+            forever
+        :return: exit code of cmd as the generator's return value, None if it
+            was interrupted
+        :raises TimeoutError: no output arrived within timeout
+        """
+        cmd = cmd.strip()
+        newline = self.client_config.newline
+        tag = self.client_config.batch_trig.format(seq=next(self._batch_seq))
+        end = re.compile(f"{re.escape(tag)}(-?\\d+)")
+        status = None
+        self.check_for_conn()
+        with self._lock, self.metrics.timed(cmd, self.traffic):
+            self.readall()
+            self.write(f"{cmd};\\{newline}echo {tag}$?{newline}")
+            self.conn.read_until(f"{tag}$?{newline}".encode(), timeout)
+            lines = self.conn.iter_lines(newline.encode(), timeout)
+            try:
+                for raw in lines:
+                    line = raw.decode(errors="replace")
+                    match = end.search(line)
+                    if match:
+                        status = int(match.group(1))
+                        if match.start():
+                            yield line[: match.start()]
+                        break
+                    if not self.line_is_stdin(line):
+                        yield line.rstrip(newline)
+            finally:
+                lines.close()
+                if status is None:
+                    status = self._drain(end)
+                if status is None:
+                    self._interrupt()
+        self._invalidate_queries([cmd])
+        if status:
+            self.logger.error(f"QSR Command FAILED with exit code {status}: {cmd}")
+        return status
+
+    def _drain(self, end: Pattern) -> Optional[int]:
+        """Discard the output already received, up to the end tag if it is there
+
+        :param end: end tag regex capturing the exit code
+        :return: exit code if the command has already finished, else None
+        """
+        try:
+            tail = self.conn.read_very_eager().decode(errors="replace")
+        except EOFError:
+            return None
+        match = end.search(tail)
+        return int(match.group(1)) if match else None
+
+    def _interrupt(self, timeout: float = 2):
+        """Stop the running command with Ctrl-C and wait for the shell
+
+        The session is dropped if the shell does not answer, so the next
+        command reconnects.
+        """
+        if self.conn.eof:
+            self.exit()
+            self.conn = None
+            return
+        newline = self.client_config.newline
+        seq = next(self._batch_seq)
+        sentinel = STREAM_SYNC.format(seq=seq)
+        try:
+            self.conn.write(b"\x03")
+            # the tty drops pending input on Ctrl-C, so wait for the prompt first
+            self.conn.read_until(self.client_config.bash_prompt.encode(), timeout)
+            typed = STREAM_SYNC.replace("SYNC", '""SYNC').format(seq=seq)
+            self.write(f"echo {typed}{newline}")
+            synced = self.conn.read_until(
+                f"{sentinel}{newline}".encode(), timeout
+            ).endswith(f"{sentinel}{newline}".encode())
+        except (EOFError, OSError):
+            synced = False
+        if not synced:
+            self.logger.warning("QSR did not resync after Ctrl-C; reconnecting")
+            self.exit()
+            self.conn = None
+
+    def run_batch(
+        self, cmds: List[str], stop_on_error: bool = False
+    ) -> List[BatchStep]:
+        """Run a command sequence as one shell script on the QSR
+
+        The script is written with a heredoc, run and removed in a single
+        round trip, so the command loop runs on the device.
+
+        :param cmds: shell commands (call_qcsapi, starry_moac, ...), one per step
+        :param stop_on_error: stop the script at the first failing step
+        :return: one BatchStep per step that ran
+        """
+        cmds = [cmd.strip() for cmd in cmds]
+        if not cmds:
+            return []
+        newline = self.client_config.newline
+        tag = self.client_config.batch_trig.format(seq=next(self._batch_seq))
+        script = self.server_config.qsr_staging_dir
+        script += f"/s4_batch_{uuid.uuid4().hex}.sh"
+        body = []
+        for idx, cmd in enumerate(cmds):
+            body.append(cmd)
+            mark = BATCH_STEP_MARK.format(idx=idx)
+            body.append(f"s4_status=$?; printf '\\n{mark}%s\\n' $s4_status")
+            if stop_on_error:
+                body.append("[ $s4_status -eq 0 ] || exit $s4_status")
+        header = (
+            f"cat > {script} << '{BATCH_EOF}'; sh {script}; s4_status=$?; "
+            f"rm -f {script}; echo {tag}$s4_status"
         )
-        check_output(
-            f"rm -f {self.server_config.tftp_root}/{self.server_config.tftp_linkname}".split()
+        payload = newline.join([header, *body, BATCH_EOF]) + newline
+        self.check_for_conn()
+        key = batch_type(cmds, "run_batch")
+        with self._lock, self.metrics.timed(cmds[0], self.traffic, key):
+            self.readall()
+            self.write(payload)
+            raw = self.conn.read_until(batch_end([tag], newline)).decode()
+        self._invalidate_queries(cmds)
+
+        echoed = {header, BATCH_EOF, *(line.strip() for line in body)}
+        # the script only runs once its heredoc terminator has been echoed
+        eof = re.search(f"^(?:> )*{BATCH_EOF}\r?$", raw, re.MULTILINE)
+        start = eof.end() if eof else 0
+        steps = []
+        for match in BATCH_STEP_RE.finditer(raw, start):
+            outpt = strip_echo(raw[start : match.start()], echoed)
+            start = match.end()
+            cmd = cmds[int(match.group(1))]
+            status = int(match.group(2))
+            if status:
+                self.logger.error(f"QSR Command FAILED with exit code {status}: {cmd}")
+            steps.append(BatchStep(cmd, outpt, status))
+        return steps
+
+    def _tftp_server(self) -> TftpServer:
+        config = self.server_config
+        return get_tftp_server(config.tftp_bind, config.tftp_port)
+
+    def _tftp_cmd(self, direction: str, name: str, filename_qsr: str) -> str:
+        blksize = self.server_config.tftp_blksize
+        return (
+            f"tftp {direction} -r {name} -l {shlex.quote(filename_qsr)} "
+            f"{'-b %d ' % blksize if blksize else ''}"
+            f"{self.server_config.hostname} {self.server_config.tftp_port}"
         )
+
+    def download_file(self, filename_server, filename_qsr, compress=False, verify=True):
+        """Download a file or directory from the QSR via TFTP
+
+        :param compress: gzip on the QSR before sending
+        :param verify: compare md5 checksums after the transfer
+        """
+        self.download_files([(filename_server, filename_qsr)], compress, verify)
+
+    def upload_file(self, filename_server, filename_qsr, compress=False, verify=True):
+        """Upload a file or directory to the QSR via TFTP
+
+        :param compress: gzip on the server and unpack on the QSR
+        :param verify: compare md5 checksums after the transfer
+        """
+        self.upload_files([(filename_server, filename_qsr)], compress, verify)
+
+    def download_files(
+        self,
+        pairs: List[Tuple[str, str]],
+        compress: bool = False,
+        verify: bool = True,
+    ):
+        """Download files or directories from the QSR in one batch
+
+        Each transfer gets its own name on the in-process TFTP server.
+        Directories are sent as a tar archive and unpacked on the server.
+
+        :param pairs: (filename_server, filename_qsr) tuples
+        :param compress: gzip on the QSR before sending
+        :param verify: compare md5 checksums after the transfer
+        :raises IOError: if a transfer or checksum fails
+        """
+        server = self._tftp_server()
+        gz_pipe = " | gzip -c" if compress else ""
+        jobs = []
+        cmds = []
+        for filename_server, filename_qsr in pairs:
+            name = f"s4_{uuid.uuid4().hex}"
+            local = os.path.join(tempfile.gettempdir(), name)
+            stage = f"{self.server_config.qsr_staging_dir}/{name}"
+            src = shlex.quote(filename_qsr)
+            stage_file = (
+                f"gzip -c {src} > {stage}"
+                if compress
+                else f'ln -sf "$(readlink -f {src})" {stage}'
+            )
+            server.expect(name, local)
+            jobs.append((name, local, filename_server, filename_qsr))
+            cmds += [
+                f"if [ -d {src} ]; then tar -c -C {src} -f - .{gz_pipe} > {stage}; "
+                f"echo dir; else {stage_file}; echo file; fi; md5sum {stage}",
+                self._tftp_cmd("-p", name, stage),
+                f"rm -f {stage}",
+            ]
+        try:
+            results = self.communicate_many(cmds)
+            for idx, (name, local, filename_server, filename_qsr) in enumerate(jobs):
+                (staged, stage_status), (sent, send_status) = results[
+                    3 * idx : 3 * idx + 2
+                ]
+                if stage_status or send_status:
+                    raise IOError(
+                        f"Download of {filename_qsr} failed: {staged} {sent}"
+                    )
+                server.wait(name, self.server_config.tftp_timeout)
+                kind, md5 = staged.split()[:2]
+                if verify and file_md5(local) != md5:
+                    raise IOError(f"Checksum mismatch downloading {filename_qsr}")
+                if kind == "dir":
+                    Path(filename_server).mkdir(parents=True, exist_ok=True)
+                    with tarfile.open(local, "r:gz" if compress else "r:") as tar:
+                        tar.extractall(filename_server, filter="data")
+                elif compress:
+                    with gzip.open(local, "rb") as ifile:
+                        with open(filename_server, "wb") as ofile:
+                            shutil.copyfileobj(ifile, ofile)
+                else:
+                    shutil.move(local, filename_server)
+        finally:
+            for name, local, *_ in jobs:
+                server.withdraw(name)
+                if os.path.exists(local):
+                    os.remove(local)
+
+    def upload_files(
+        self,
+        pairs: List[Tuple[str, str]],
+        compress: bool = False,
+        verify: bool = True,
+    ):
+        """Upload files or directories to the QSR in one batch
+
+        Each transfer gets its own name on the in-process TFTP server.
+        Directories are sent as a tar archive and unpacked on the QSR.
+
+        :param pairs: (filename_server, filename_qsr) tuples
+        :param compress: gzip on the server and unpack on the QSR
+        :param verify: compare md5 checksums on the QSR before unpacking
+        :raises IOError: if a transfer or checksum fails
+        """
+        server = self._tftp_server()
+        jobs = []
+        cmds = []
+        try:
+            for filename_server, filename_qsr in pairs:
+                name = f"s4_{uuid.uuid4().hex}"
+                dst = shlex.quote(filename_qsr)
+                stage = f"{self.server_config.qsr_staging_dir}/{name}"
+                local = os.path.join(tempfile.gettempdir(), name)
+                if Path(filename_server).is_dir():
+                    with tarfile.open(local, "w:gz" if compress else "w") as tar:
+                        tar.add(filename_server, arcname=".")
+                    untar = f"tar -x -C {dst} -f {stage}"
+                    if compress:
+                        untar = f"gzip -dc {stage} | tar -x -C {dst} -f -"
+                    unpack = [f"mkdir -p {dst}", untar]
+                elif compress:
+                    with open(filename_server, "rb") as ifile:
+                        with gzip.open(local, "wb") as ofile:
+                            shutil.copyfileobj(ifile, ofile)
+                    unpack = [f"gzip -dc {stage} > {dst}"]
+                else:
+                    local, stage, unpack = filename_server, dst, []
+                steps = [self._tftp_cmd("-g", name, stage)]
+                if verify:
+                    md5 = file_md5(local)
+                    steps.append(
+                        f'{{ [ "$(md5sum {stage} | cut -d" " -f1)" = "{md5}" ] '
+                        "|| { echo checksum mismatch; false; }; }"
+                    )
+                cmd = " && ".join(steps + unpack)
+                if stage != dst:
+                    cmd += f"; status=$?; rm -f {stage}; [ $status -eq 0 ]"
+                server.offer(name, local)
+                jobs.append((name, local, filename_server, filename_qsr))
+                cmds.append(cmd)
+            results = self.communicate_many(cmds)
+            for (name, _, _, filename_qsr), (outpt, status) in zip(jobs, results):
+                if status:
+                    raise IOError(f"Upload of {filename_qsr} failed: {outpt}")
+                server.wait(name, self.server_config.tftp_timeout)
+        finally:
+            for name, local, filename_server, _ in jobs:
+                server.withdraw(name)
+                if local != filename_server and os.path.exists(local):
+                    os.remove(local)
+
+
+class S4ConnectPool:
+    """Process-wide pool of live S4Connect sessions keyed by (hostname, port)
+
+    The first caller for a key sets the server config used by that session.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self._sessions: Dict[Tuple[str, int], S4Connect] = {}
+        self._verified: Set[Tuple[Tuple[str, int], Callable]] = set()
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        client_config: dict,
+        server_config: Optional[dict] = None,
+        verify: Optional[Callable[[S4Connect], None]] = None,
+    ) -> S4Connect:
+        """Return a live session, connecting or reconnecting if needed
+
+        :param client_config: S4ConnectClientConfig fields
+        :param server_config: S4ConnectServerConfig fields for a new session
+        :param verify: check run once per session; raise to reject it
+        """
+        config = S4ConnectClientConfig(**client_config)
+        key = (config.hostname, config.telnet_port)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None and not session.is_alive():
+                self.logger.debug(f"Dropping dead QSR session {key}")
+                self._drop(key)
+                session = None
+            if session is None:
+                session = S4Connect(client_config, server_config, autostart=True)
+                self._sessions[key] = session
+            if verify is not None and (key, verify) not in self._verified:
+                try:
+                    verify(session)
+                except Exception:
+                    self._drop(key)
+                    raise
+                self._verified.add((key, verify))
+        return session
+
+    def _drop(self, key: Tuple[str, int]):
+        session = self._sessions.pop(key, None)
+        if session is not None:
+            session.exit()
+        self._verified = {item for item in self._verified if item[0] != key}
+
+    def discard(self, hostname: str = DEFAULT_QSR_IP, telnet_port: int = 23):
+        """Close and forget the session for (hostname, telnet_port)"""
+        with self._lock:
+            self._drop((hostname, telnet_port))
+
+    def close_all(self):
+        """Close every pooled session"""
+        with self._lock:
+            for key in list(self._sessions):
+                self._drop(key)
+
+
+SESSION_POOL = S4ConnectPool()
+atexit.register(SESSION_POOL.close_all)
@@ -0,0 +1,204 @@
+"""Round-trip metrics for QSR commands sent through S4Connect"""
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+from utils import save_yaml
+
+# Upper bucket bounds in ms: 0.25 ms .. 16 s, then overflow
+BUCKET_BOUNDS_MS = tuple(2.0**exp for exp in range(-2, 15))
+
+
+class LatencyHistogram:
+    """Log2-bucketed latency histogram"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.min_ms = float("inf")
+        self.max_ms = 0.0
+
+    def record(self, latency_ms: float):
+        """Add one sample"""
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS_MS, latency_ms)] += 1
+        self.count += 1
+        self.total_ms += latency_ms
+        self.min_ms = min(self.min_ms, latency_ms)
+        self.max_ms = max(self.max_ms, latency_ms)
+
+    def percentile(self, pct: float) -> float:
+        """Approximate percentile in ms (upper bound of the bucket)"""
+        if not self.count:
+            return 0.0
+        target = pct / 100 * self.count
+        seen = 0
+        for bound, count in zip(BUCKET_BOUNDS_MS, self.counts):
+            seen += count
+            if seen >= target:
+                return round(min(bound, self.max_ms), 3)
+        return round(self.max_ms, 3)
+
+    def to_dict(self) -> dict:
+        """Summary of the histogram"""
+        buckets = {
+            f"<={bound:g}ms": count
+            for bound, count in zip(BUCKET_BOUNDS_MS, self.counts)
+            if count
+        }
+        if self.counts[-1]:
+            buckets[f">{BUCKET_BOUNDS_MS[-1]:g}ms"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "total_ms": round(self.total_ms, 3),
+            "mean_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "min_ms": round(self.min_ms, 3) if self.count else 0.0,
+            "p50_ms": self.percentile(50),
+            "p90_ms": self.percentile(90),
+            "p99_ms": self.percentile(99),
+            "max_ms": round(self.max_ms, 3),
+            "buckets": buckets,
+        }
+
+
+class CommandStats:
+    """Everything recorded for one command type"""
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.retries = 0
+        self.parse_failures = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+
+    def to_dict(self) -> dict:
+        """Summary of the command type"""
+        return {
+            **self.latency.to_dict(),
+            "retries": self.retries,
+            "parse_failures": self.parse_failures,
+            "bytes_out": self.bytes_out,
+            "bytes_in": self.bytes_in,
+        }
+
+
+def command_type(cmd: str) -> str:
+    """Group a QSR command line by what it runs
+
+    e.g. "call_qcsapi get_bootcfg_param calstate" -> "call_qcsapi get_bootcfg_param"
+    """
+    words = cmd.replace(";", " ").split()
+    if not words:
+        return ""
+    if words[0] != "call_qcsapi" or len(words) < 2:
+        return words[0]
+    if words[1:4] == ["run_script", "remote_command", "starry_moac"]:
+        return " ".join(["starry_moac", *words[4:5]])
+    return f"call_qcsapi {words[1]}"
+
+
+def batch_type(cmds: List[str], prefix: str = "batch") -> str:
+    """Group commands sent together: a single command keeps its command_type,
+    otherwise prefix:<types in order of first use>
+
+    e.g. ["stop_test_packet", "set_test_mode 36 ..."] ->
+    "batch:stop_test_packet+set_test_mode"
+    """
+    types = list(dict.fromkeys(command_type(cmd) for cmd in cmds))
+    if len(cmds) == 1:
+        return types[0]
+    return f"{prefix}:{'+'.join(types)}"
+
+
+class S4Metrics:
+    """Per-command-type latency histograms, retries, bytes and parse failures"""
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.commands: Dict[str, CommandStats] = {}
+        self._lock = threading.Lock()
+
+    def _stats(self, cmd: str, key: Optional[str] = None) -> CommandStats:
+        key = command_type(cmd) if key is None else key
+        if key not in self.commands:
+            self.commands[key] = CommandStats()
+        return self.commands[key]
+
+    @contextmanager
+    def timed(
+        self,
+        cmd: str,
+        traffic: Optional[Callable[[], Tuple[int, int]]] = None,
+        key: Optional[str] = None,
+    ):
+        """Record the latency (and traffic) of the wrapped exchange
+
+        :param cmd: command line, grouped with command_type()
+        :param traffic: returns (bytes_in, bytes_out) counters of the link
+        :param key: record under this key instead, e.g. batch_type() of a batch
+        """
+        before = traffic() if traffic else (0, 0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            latency_ms = (time.perf_counter() - start) * 1e3
+            after = traffic() if traffic else (0, 0)
+            with self._lock:
+                stats = self._stats(cmd, key)
+                stats.latency.record(latency_ms)
+                stats.bytes_in += max(after[0] - before[0], 0)
+                stats.bytes_out += max(after[1] - before[1], 0)
+
+    def retry(self, cmd: str):
+        """Count one retry of cmd"""
+        with self._lock:
+            self._stats(cmd).retries += 1
+
+    def parse_failure(self, cmd: str):
+        """Count one response of cmd that could not be parsed"""
+        with self._lock:
+            self._stats(cmd).parse_failures += 1
+
+    def reset(self):
+        """Forget everything recorded so far"""
+        with self._lock:
+            self.commands = {}
+
+    def summary(self) -> Dict[str, dict]:
+        """Per-command-type summary, most total time first"""
+        with self._lock:
+            items = sorted(
+                self.commands.items(), key=lambda item: -item[1].latency.total_ms
+            )
+            return {key: stats.to_dict() for key, stats in items}
+
+    def report(self) -> str:
+        """Summary as a text table"""
+        lines = [
+            f"{'command':60} {'count':>6} {'total s':>9} {'mean ms':>9} "
+            f"{'p90 ms':>8} {'retries':>7} {'fails':>5} {'in kB':>8}"
+        ]
+        for key, stats in self.summary().items():
+            lines.append(
+                f"{key[:60]:60} {stats['count']:6d} {stats['total_ms'] / 1e3:9.3f} "
+                f"{stats['mean_ms']:9.2f} {stats['p90_ms']:8.2f} "
+                f"{stats['retries']:7d} {stats['parse_failures']:5d} "
+                f"{stats['bytes_in'] / 1e3:8.1f}"
+            )
+        return "\n".join(lines)
+
+    def log_summary(self, level: int = logging.INFO):
+        """Log the text table"""
+        self.logger.log(level, f"QSR command metrics:\n{self.report()}")
+
+    def save(self, filename: str):
+        """Write the summary to a YAML file"""
+        save_yaml(filename, self.summary())
+
+
+# Default sink shared by every S4Connect in the process
+S4_METRICS = S4Metrics()
@@ -0,0 +1,210 @@
+"""Selector-based Telnet client used in place of the deprecated telnetlib"""
+import time
+import socket
+import selectors
+from typing import Iterator, Optional, Pattern, Tuple, Union
+
+IAC = 255
+DONT = 254
+DO = 253
+WONT = 252
+WILL = 251
+SB = 250
+SE = 240
+
+RECV_SIZE = 65536
+
+
+class TelnetFilter:
+    """Strips Telnet negotiation from an incoming byte stream
+
+    Every DO/WILL request is refused (WONT/DONT), the same as telnetlib does
+    without an option callback. Sequences split across reads are kept until
+    the rest arrives.
+    """
+
+    def __init__(self):
+        self._pending = bytearray()
+
+    def feed(self, data: bytes) -> Tuple[bytes, bytes]:
+        """Filter one chunk from the socket
+
+        :param data: raw bytes read from the socket
+        :return: (payload bytes, negotiation replies to send back)
+        """
+        if not self._pending and IAC not in data:
+            return data, b""
+        buf = self._pending + data
+        self._pending = bytearray()
+        payload = bytearray()
+        reply = bytearray()
+        idx = 0
+        while idx < len(buf):
+            nxt = buf.find(IAC, idx)
+            if nxt < 0:
+                payload += buf[idx:]
+                break
+            payload += buf[idx:nxt]
+            if nxt + 1 >= len(buf):
+                self._pending = buf[nxt:]
+                break
+            cmd = buf[nxt + 1]
+            if cmd == IAC:
+                payload.append(IAC)
+                idx = nxt + 2
+            elif cmd in (DO, DONT, WILL, WONT):
+                if nxt + 2 >= len(buf):
+                    self._pending = buf[nxt:]
+                    break
+                opt = buf[nxt + 2]
+                if cmd == DO:
+                    reply += bytes((IAC, WONT, opt))
+                elif cmd == WILL:
+                    reply += bytes((IAC, DONT, opt))
+                idx = nxt + 3
+            elif cmd == SB:
+                end = buf.find(bytes((IAC, SE)), nxt + 2)
+                if end < 0:
+                    self._pending = buf[nxt:]
+                    break
+                idx = end + 2
+            else:
+                idx = nxt + 2
+        return bytes(payload), bytes(reply)
+
+
+class TelnetSocket:
+    """Telnet connection that reads into a bytearray and waits on a selector
+
+    Reads return as soon as the requested token shows up in the buffer; there
+    is no polling interval.
+    """
+
+    def __init__(self, host: str, port: int = 23, timeout: Optional[float] = None):
+        self.sock = socket.create_connection((host, port), timeout)
+        self.sock.settimeout(None)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ)
+        self.filter = TelnetFilter()
+        self.buffer = bytearray()
+        self.eof = False
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def fileno(self) -> int:
+        """Socket file descriptor"""
+        return self.sock.fileno()
+
+    def _fill(self, timeout: Optional[float]) -> bool:
+        """Wait up to timeout for data and append it to the buffer
+
+        :return: True if anything was read
+        """
+        if self.eof:
+            return False
+        if not self.selector.select(timeout):
+            return False
+        data = self.sock.recv(RECV_SIZE)
+        if not data:
+            self.eof = True
+            return False
+        self.bytes_in += len(data)
+        payload, reply = self.filter.feed(data)
+        if reply:
+            self.sock.sendall(reply)
+        self.buffer += payload
+        return True
+
+    def _consume(self, end: int) -> bytes:
+        data = bytes(self.buffer[:end])
+        del self.buffer[:end]
+        return data
+
+    def read_until(
+        self, match: Union[bytes, Pattern[bytes]], timeout: Optional[float] = None
+    ) -> bytes:
+        """Read until a token or regex match, inclusive
+
+        Regex patterns must not span lines; the search restarts from the last
+        complete line after every read. On timeout the buffered data is
+        returned, like telnetlib.
+
+        :param match: bytes token or compiled bytes regex
+        :param timeout: seconds to wait, None waits forever
+        :raises EOFError: connection closed and nothing is buffered
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        start = 0
+        while True:
+            if isinstance(match, bytes):
+                idx = self.buffer.find(match, start)
+                if idx >= 0:
+                    return self._consume(idx + len(match))
+                start = max(0, len(self.buffer) - len(match) + 1)
+            else:
+                found = match.search(self.buffer, start)
+                if found:
+                    return self._consume(found.end())
+                start = self.buffer.rfind(b"\n") + 1
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return self._consume(len(self.buffer))
+            if not self._fill(remaining) and self.eof:
+                if not self.buffer:
+                    raise EOFError("Telnet connection closed")
+                return self._consume(len(self.buffer))
+
+    def iter_lines(
+        self, newline: bytes = b"\n", timeout: Optional[float] = None
+    ) -> Iterator[bytes]:
+        """Yield complete lines, newline included, as they arrive
+
+        Lines are sliced straight out of the receive buffer; the consumed part
+        is dropped once per read instead of once per line. Anything after the
+        last line handed out stays buffered when the iterator is closed.
+
+        :param newline: line terminator
+        :param timeout: seconds to wait for each read, None waits forever
+        :raises TimeoutError: nothing arrived within timeout
+        :raises EOFError: connection closed
+        """
+        start = 0
+        try:
+            while True:
+                idx = self.buffer.find(newline, start)
+                if idx >= 0:
+                    end = idx + len(newline)
+                    line = bytes(self.buffer[start:end])
+                    start = end
+                    yield line
+                    continue
+                del self.buffer[:start]
+                start = 0
+                if not self._fill(timeout):
+                    if self.eof:
+                        raise EOFError("Telnet connection closed")
+                    raise TimeoutError(f"No data from the QSR within {timeout} s")
+        finally:
+            del self.buffer[:start]
+
+    def read_very_eager(self) -> bytes:
+        """Return everything that can be read without blocking"""
+        while self._fill(0):
+            pass
+        if self.eof and not self.buffer:
+            raise EOFError("Telnet connection closed")
+        return self._consume(len(self.buffer))
+
+    def write(self, data: bytes):
+        """Send data, escaping IAC bytes"""
+        data = data.replace(bytes((IAC,)), bytes((IAC, IAC)))
+        self.bytes_out += len(data)
+        self.sock.sendall(data)
+
+    def close(self):
+        """Close the connection"""
+        self.selector.close()
+        self.sock.close()
+        self.eof = True
+
@@ -0,0 +1,231 @@
+"""In-process TFTP server used for QSR file transfers
+
+Only files registered with offer()/expect() are served or accepted, each under
+its own name, so several transfers can run at once without a system tftpd.
+Supports the blksize and tsize options (RFC 2348/2349).
+"""
+import os
+import socket
+import struct
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+RRQ, WRQ, DATA, ACK, ERROR, OACK = 1, 2, 3, 4, 5, 6
+DEFAULT_BLKSIZE = 512
+MAX_BLKSIZE = 65464
+
+
+class TftpError(IOError):
+    """TFTP transfer failed"""
+
+
+class _Transfer:
+    """One registered file and the outcome of its transfer"""
+
+    def __init__(self, path: str, upload: bool):
+        self.path = path
+        self.upload = upload  # True: we serve the file (QSR runs tftp -g)
+        self.done = threading.Event()
+        self.error: Optional[str] = None
+        self.peer: Optional[Tuple[str, int]] = None  # client that claimed it
+
+
+class TftpServer:
+    """TFTP server running in a background thread"""
+
+    def __init__(
+        self,
+        host: str = "0.0.0.0",
+        port: int = 6969,
+        timeout: float = 1.0,
+        retries: int = 5,
+    ):
+        self.logger = logging.getLogger(__name__)
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.retries = retries
+        self.sock: Optional[socket.socket] = None
+        self._transfers: Dict[str, _Transfer] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Bind the listening socket and start serving"""
+        if self._thread is not None:
+            return
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.host, self.port))
+        self.port = self.sock.getsockname()[1]
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop serving; running transfers finish on their own sockets"""
+        if self.sock is not None:
+            self.sock.close()
+        self._thread = None
+
+    def offer(self, name: str, path: str):
+        """Serve path under name for one read request"""
+        with self._lock:
+            self._transfers[name] = _Transfer(path, upload=True)
+
+    def expect(self, name: str, path: str):
+        """Accept one write request for name and store it at path"""
+        with self._lock:
+            self._transfers[name] = _Transfer(path, upload=False)
+
+    def wait(self, name: str, timeout: Optional[float] = None):
+        """Wait for a registered transfer to finish and forget it
+
+        :raises TftpError: if the transfer failed or did not finish in time
+        """
+        with self._lock:
+            transfer = self._transfers[name]
+        finished = transfer.done.wait(timeout)
+        self.withdraw(name)
+        if not finished:
+            raise TftpError(f"TFTP transfer {name} did not finish")
+        if transfer.error:
+            raise TftpError(f"TFTP transfer {name} failed: {transfer.error}")
+
+    def withdraw(self, name: str):
+        """Forget a registered transfer"""
+        with self._lock:
+            self._transfers.pop(name, None)
+
+    def _serve(self):
+        while True:
+            try:
+                packet, addr = self.sock.recvfrom(MAX_BLKSIZE + 4)
+            except OSError:
+                return
+            try:
+                opcode, name, options = self._parse_request(packet)
+            except (ValueError, struct.error, UnicodeDecodeError):
+                continue
+            with self._lock:
+                transfer = self._transfers.get(name)
+                if transfer is not None and transfer.upload != (opcode == RRQ):
+                    transfer = None
+                peer = transfer.peer if transfer is not None else None
+                if transfer is not None and peer is None:
+                    transfer.peer = addr
+            if peer == addr:
+                # retransmitted request: its handler is already answering
+                continue
+            if transfer is None or peer is not None:
+                self._send_error(self.sock, addr, 1, f"Unknown transfer {name}")
+                continue
+            handler = self._send_file if opcode == RRQ else self._receive_file
+            threading.Thread(
+                target=self._run, args=(handler, transfer, addr, options), daemon=True
+            ).start()
+
+    @staticmethod
+    def _parse_request(packet: bytes) -> Tuple[int, str, Dict[str, str]]:
+        (opcode,) = struct.unpack("!H", packet[:2])
+        if opcode not in (RRQ, WRQ):
+            raise ValueError(f"Unexpected opcode {opcode}")
+        fields = packet[2:].split(b"\0")[:-1]
+        name = os.path.basename(fields[0].decode())
+        opts = [field.decode().lower() for field in fields[2:]]
+        return opcode, name, dict(zip(opts[::2], opts[1::2]))
+
+    def _run(self, handler, transfer: _Transfer, addr, options: Dict[str, str]):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((self.host, 0))
+        sock.settimeout(self.timeout)
+        try:
+            handler(sock, transfer, addr, options)
+        except (OSError, TftpError) as err:
+            transfer.error = str(err)
+            self.logger.debug(f"TFTP {transfer.path} failed: {err}")
+        finally:
+            sock.close()
+            transfer.done.set()
+
+    @staticmethod
+    def _send_error(sock, addr, code: int, msg: str):
+        sock.sendto(struct.pack("!HH", ERROR, code) + msg.encode() + b"\0", addr)
+
+    def _exchange(self, sock, addr, packet: bytes, opcode: int, block: int) -> bytes:
+        """Send packet until the peer answers with (opcode, block)"""
+        for _ in range(self.retries):
+            sock.sendto(packet, addr)
+            while True:
+                try:
+                    reply, peer = sock.recvfrom(MAX_BLKSIZE + 4)
+                except socket.timeout:
+                    break
+                if peer != addr or len(reply) < 4:
+                    continue
+                code, num = struct.unpack("!HH", reply[:4])
+                if code == ERROR:
+                    raise TftpError(reply[4:].rstrip(b"\0").decode(errors="replace"))
+                if code == opcode and num == block:
+                    return reply
+        raise TftpError(f"Timed out waiting for block {block}")
+
+    def _negotiate(self, options: Dict[str, str], tsize: Optional[int]):
+        """Return (blksize, OACK packet or None) for the requested options"""
+        accepted = {}
+        blksize = DEFAULT_BLKSIZE
+        if "blksize" in options:
+            blksize = min(max(int(options["blksize"]), 8), MAX_BLKSIZE)
+            accepted["blksize"] = str(blksize)
+        if "tsize" in options:
+            accepted["tsize"] = str(tsize if tsize is not None else options["tsize"])
+        if not accepted:
+            return blksize, None
+        body = b"".join(f"{key}\0{value}\0".encode() for key, value in accepted.items())
+        return blksize, struct.pack("!H", OACK) + body
+
+    def _send_file(self, sock, transfer: _Transfer, addr, options: Dict[str, str]):
+        size = os.path.getsize(transfer.path)
+        blksize, oack = self._negotiate(options, size)
+        if oack is not None:
+            self._exchange(sock, addr, oack, ACK, 0)
+        with open(transfer.path, "rb") as ifile:
+            block = 1
+            while True:
+                chunk = ifile.read(blksize)
+                packet = struct.pack("!HH", DATA, block & 0xFFFF) + chunk
+                self._exchange(sock, addr, packet, ACK, block & 0xFFFF)
+                if len(chunk) < blksize:
+                    return
+                block += 1
+
+    def _receive_file(self, sock, transfer: _Transfer, addr, options: Dict[str, str]):
+        blksize, oack = self._negotiate(options, None)
+        reply = oack if oack is not None else struct.pack("!HH", ACK, 0)
+        partial = f"{transfer.path}.part"
+        with open(partial, "wb") as ofile:
+            block = 1
+            while True:
+                data = self._exchange(sock, addr, reply, DATA, block & 0xFFFF)
+                ofile.write(data[4:])
+                reply = struct.pack("!HH", ACK, block & 0xFFFF)
+                if len(data) - 4 < blksize:
+                    break
+                block += 1
+        sock.sendto(reply, addr)
+        os.replace(partial, transfer.path)
+
+
+_SERVERS: Dict[Tuple[str, int], TftpServer] = {}
+_SERVERS_LOCK = threading.Lock()
+
+
+def get_tftp_server(host: str = "0.0.0.0", port: int = 6969) -> TftpServer:
+    """Return the process-wide server for (host, port), starting it if needed"""
+    with _SERVERS_LOCK:
+        server = _SERVERS.get((host, port))
+        if server is None:
+            server = TftpServer(host, port)
+            server.start()
+            _SERVERS[(host, port)] = server
+        return server
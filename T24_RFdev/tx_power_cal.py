@@ -0,0 +1,173 @@
+"""TX power calibration of QsrMfg.set_tx_pow against the spectrum analyzer
+
+Sweeps spi_id x requested power per channel, measures the output on the FSW,
+fits requested power as a polynomial of measured power for every
+(channel, spi_id) and saves the coefficients as a YAML lookup table. Later runs
+load the table and set a target output power in one command.
+
+Usage:
+    python tx_power_cal.py --channels 36 100 --output tx_power_cal.yaml
+    TxPowerTable.load("tx_power_cal.yaml").apply(QsrMfg(), 100, 0, 15.0)
+"""
+import time
+import logging
+import argparse
+from dataclasses import replace
+from typing import Dict, Iterable, Optional, Tuple
+
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    print("Couldn't import numpy")
+try:
+    from hw_qa_tools.fsw import SpectrumAnalyzer
+except ModuleNotFoundError:
+    print("Couldn't import hw_qa_tools")
+
+from qsr_mfg import QsrMfg, TestModeConfig
+from utils import load_yaml, save_yaml
+
+DEFAULT_FSW_IP = "10.13.23.90"
+
+
+def sweep_tx_power(
+    qsr: QsrMfg,
+    fsw,
+    channels: Iterable[int],
+    spi_ids: Iterable[int] = (0, 1),
+    powers_dbm: Iterable[float] = range(5, 21),
+    config: TestModeConfig = TestModeConfig(),
+    settle_s: float = 0.5,
+) -> Dict[str, "np.ndarray"]:
+    """Measure the output power for every channel x spi_id x requested power
+
+    :param qsr: QSR in MFG mode
+    :param fsw: SpectrumAnalyzer set up for WLAN measurements
+    :param channels: channels to calibrate
+    :param spi_ids: antenna groups, see QsrMfg.set_tx_pow
+    :param powers_dbm: requested powers to sweep
+    :param config: test mode; channel is replaced by each swept channel
+    :param settle_s: wait after setting power before measuring
+    :return: columns channel, spi_id, requested_dbm, measured_dbm
+    """
+    logger = logging.getLogger(__name__)
+    rows = []
+    powers_dbm = list(powers_dbm)
+    for channel in channels:
+        qsr.transmit(replace(config, channel=channel))
+        for spi_id in spi_ids:
+            for power_dbm in powers_dbm:
+                qsr.set_tx_pow(spi_id, power_dbm)
+                time.sleep(settle_s)
+                measured = fsw.get_wlan_results()["avg rms power"]
+                logger.debug(
+                    f"ch {channel} spi {spi_id}: {power_dbm} dBm -> {measured} dBm"
+                )
+                rows.append((channel, spi_id, power_dbm, measured))
+    data = np.array(rows, dtype=float).reshape(-1, 4)
+    return {
+        "channel": data[:, 0].astype(int),
+        "spi_id": data[:, 1].astype(int),
+        "requested_dbm": data[:, 2],
+        "measured_dbm": data[:, 3],
+    }
+
+
+class TxPowerTable:
+    """Per (channel, spi_id) polynomial: requested power = f(output power)"""
+
+    def __init__(self, entries: Optional[Dict[Tuple[int, int], dict]] = None):
+        self.logger = logging.getLogger(__name__)
+        self.entries = entries or {}
+
+    @classmethod
+    def fit(cls, sweep: Dict[str, "np.ndarray"], degree: int = 2) -> "TxPowerTable":
+        """Fit the sweep from sweep_tx_power()
+
+        :param degree: polynomial degree, lowered for groups with few points
+        """
+        entries = {}
+        keys = np.stack([sweep["channel"], sweep["spi_id"]], axis=1)
+        for channel, spi_id in np.unique(keys, axis=0):
+            mask = (sweep["channel"] == channel) & (sweep["spi_id"] == spi_id)
+            measured = sweep["measured_dbm"][mask]
+            requested = sweep["requested_dbm"][mask]
+            coeffs = np.polyfit(measured, requested, min(degree, len(measured) - 1))
+            residual = requested - np.polyval(coeffs, measured)
+            entries[(int(channel), int(spi_id))] = {
+                "coeffs": [float(coeff) for coeff in coeffs],
+                "min_dbm": float(measured.min()),
+                "max_dbm": float(measured.max()),
+                "rms_error_db": float(np.sqrt(np.mean(residual**2))),
+            }
+        return cls(entries)
+
+    def save(self, filename: str):
+        """Write the table as YAML: {channel: {spi_id: entry}}"""
+        table: Dict[int, Dict[int, dict]] = {}
+        for (channel, spi_id), entry in sorted(self.entries.items()):
+            table.setdefault(channel, {})[spi_id] = entry
+        save_yaml(filename, table)
+
+    @classmethod
+    def load(cls, filename: str) -> "TxPowerTable":
+        """Read a table written by save()"""
+        return cls(
+            {
+                (int(channel), int(spi_id)): entry
+                for channel, spis in load_yaml(filename).items()
+                for spi_id, entry in spis.items()
+            }
+        )
+
+    def requested_dbm(self, channel: int, spi_id: int, target_dbm: float) -> float:
+        """Power to request from set_tx_pow for target_dbm at the output
+
+        :raises IOError: if (channel, spi_id) was not calibrated
+        """
+        entry = self.entries.get((channel, spi_id))
+        if entry is None:
+            raise IOError(f"No TX power calibration for ch {channel} spi {spi_id}")
+        if not entry["min_dbm"] <= target_dbm <= entry["max_dbm"]:
+            self.logger.warning(
+                f"{target_dbm} dBm is outside the calibrated range "
+                f"{entry['min_dbm']}..{entry['max_dbm']} dBm (ch {channel})"
+            )
+        return round(float(np.polyval(entry["coeffs"], target_dbm)), 1)
+
+    def apply(self, qsr: QsrMfg, channel: int, spi_id: int, target_dbm: float):
+        """Set target_dbm output power with a single set_tx_pow"""
+        return qsr.set_tx_pow(spi_id, self.requested_dbm(channel, spi_id, target_dbm))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--channels", type=int, nargs="+", default=[36, 100])
+    parser.add_argument("--spi-ids", type=int, nargs="+", default=[0, 1])
+    parser.add_argument(
+        "--powers", type=float, nargs=3, default=[5, 20, 1], help="start stop step"
+    )
+    parser.add_argument("--degree", type=int, default=2)
+    parser.add_argument("--fsw", default=DEFAULT_FSW_IP)
+    parser.add_argument("--output", default="tx_power_cal.yaml")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    start, stop, step = args.powers
+    sweep = sweep_tx_power(
+        QsrMfg(),
+        SpectrumAnalyzer(args.fsw),
+        args.channels,
+        args.spi_ids,
+        np.arange(start, stop + step / 2, step),
+    )
+    table = TxPowerTable.fit(sweep, args.degree)
+    table.save(args.output)
+    for (channel, spi_id), entry in sorted(table.entries.items()):
+        print(f"ch {channel} spi {spi_id}: rms error {entry['rms_error_db']:.2f} dB")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,8 +2,307 @@ from titan24_prototypes.modules.lo import LO
 from titan24_prototypes.modules.shf import SHF
 from titan24_prototypes.modules.mixer import Mixer
 import time
+import logging
+from functools import partial
+from dataclasses import dataclass, fields
+from typing import Dict, List, Optional, Tuple
 import qsr_mfg
-import time
+from utils import DEFAULT_ARMADA_IP
+
+# wait between the rx and tx set_mode calls that latch DSA/mixer settings
+TR_TOGGLE_S = 0.4
+
+
+@dataclass
+class PathState:
+    """Settings of one (shf_id, path); None means unknown / leave as is"""
+
+    if_atten_db: Optional[float] = None
+    mixer_enabled: Optional[bool] = None
+    mixer_atten1: Optional[int] = None
+    mixer_atten2: Optional[int] = None
+    gate_dac: Optional[float] = None
+
+
+# every path off: max attenuation, mixer disabled, gate at -5 V
+PATH_OFF = PathState(
+    if_atten_db=31.5,
+    mixer_enabled=False,
+    mixer_atten1=15,
+    mixer_atten2=15,
+    gate_dac=2.99,
+)
+
+# (shadow keys that become unknown, shadow values once the call succeeds, call);
+# a key is (setting, shf_id[, path])
+Write = Tuple[Tuple[tuple, ...], Dict[tuple, object], partial]
+
+
+class PathTransaction:
+    """Target state of paths and boards, applied with the fewest writes
+
+    Targets are compared with the session's shadow of what was last written and
+    only differing settings are written. DSA and mixer writes are latched with
+    one rx -> tx set_mode toggle covering every board that needs it, or a
+    single set_mode("rx") for boards left in rx; gate DACs are set after the
+    toggle, as in the step-by-step helpers.
+
+    Usage:
+        with bench.transaction() as trans:
+            trans.set_lo_atten(0, 10)
+            trans.set_path(0, 2, if_atten_db=10, mixer_enabled=True)
+    """
+
+    def __init__(self, bench: "BenchSession"):
+        self.bench = bench
+        self.paths: Dict[Tuple[int, int], PathState] = {}
+        self.lo_dsa: Dict[int, float] = {}
+        self.modes: Dict[int, str] = {}
+
+    def __enter__(self) -> "PathTransaction":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+
+    def set_path(
+        self, shf_id: int, path: int, state: Optional[PathState] = None, **settings
+    ) -> "PathTransaction":
+        """Target settings of one path, merged with earlier targets
+
+        :param state: PathState to apply, e.g. PATH_OFF
+        :param settings: PathState fields, override state
+        """
+        target = self.paths.setdefault((shf_id, path), PathState())
+        for item in fields(PathState):
+            value = settings.get(item.name, getattr(state, item.name, None))
+            if value is not None:
+                setattr(target, item.name, value)
+        return self
+
+    def set_lo_atten(self, shf_id: int, lo_dsa: float) -> "PathTransaction":
+        """Target LO DSA of a board"""
+        self.lo_dsa[shf_id] = lo_dsa
+        return self
+
+    def set_mode(self, shf_id: int, mode: str) -> "PathTransaction":
+        """Mode to leave the board in; latched boards default to tx"""
+        self.modes[shf_id] = mode
+        return self
+
+    def plan(self) -> List[Write]:
+        """Writes commit() would do, in order
+
+        DSA and mixer values only count as applied once their board's final
+        set_mode latched them, so a failed toggle leaves them unknown.
+        """
+        trf, tmix = self.bench.shf, self.bench.mixer
+        latched: List[Write] = []
+        gates: List[Write] = []
+        pending: Dict[int, Dict[tuple, object]] = {}  # shf_id -> latched values
+
+        def add(writes: List[Write], key: tuple, value, func, *args):
+            if self.bench.shadow.get(key) == value:
+                return
+            if writes is gates:
+                writes.append(((key,), {key: value}, partial(func, *args)))
+            else:
+                pending.setdefault(key[1], {})[key] = value
+                writes.append(((key,), {}, partial(func, *args)))
+
+        for shf_id, lo_dsa in sorted(self.lo_dsa.items()):
+            func = trf.set_lo_attenuator
+            add(latched, ("lo_dsa", shf_id), lo_dsa, func, shf_id, lo_dsa)
+        for (shf_id, path), target in sorted(self.paths.items()):
+            at = (shf_id, path)
+            if target.if_atten_db is not None:
+                value, func = target.if_atten_db, trf.set_rf_tx_attenuator
+                add(latched, ("if_atten_db", *at), value, func, *at, value, True)
+            if target.mixer_enabled is not None:
+                func = tmix.enable_mixer if target.mixer_enabled else tmix.disable_mixer
+                add(latched, ("mixer_enabled", *at), target.mixer_enabled, func, *at)
+            if target.mixer_atten1 is not None:
+                value, func = target.mixer_atten1, tmix.set_tx_attenuator1
+                add(latched, ("mixer_atten1", *at), value, func, *at, value)
+            if target.mixer_atten2 is not None:
+                value, func = target.mixer_atten2, tmix.set_tx_attenuator2
+                add(latched, ("mixer_atten2", *at), value, func, *at, value)
+            if target.gate_dac is not None:
+                value, func = target.gate_dac, trf.set_rf_dac_voltage
+                add(gates, ("gate_dac", *at), value, func, *at, value)
+
+        # boards left in rx latch with that single set_mode, no toggle needed
+        toggled = [
+            shf_id for shf_id in sorted(pending) if self.modes.get(shf_id) != "rx"
+        ]
+        writes = list(latched)
+        if toggled:
+            # the boards' mode is unknown until the final set_mode succeeds
+            keys = tuple(("mode", shf_id) for shf_id in toggled)
+            writes.append((keys, {}, partial(trf.set_mode, "rx", toggled)))
+            writes.append(((), {}, partial(time.sleep, TR_TOGGLE_S)))
+        final: Dict[str, List[int]] = {}
+        for shf_id in sorted(set(pending) | set(self.modes)):
+            mode = self.modes.get(shf_id, "tx")
+            if shf_id in pending or self.bench.shadow.get(("mode", shf_id)) != mode:
+                final.setdefault(mode, []).append(shf_id)
+        for mode, shf_ids in final.items():
+            keys = tuple(("mode", shf_id) for shf_id in shf_ids)
+            applied = {key: mode for key in keys}
+            for shf_id in shf_ids:
+                applied.update(pending.get(shf_id, {}))
+            writes.append((keys, applied, partial(trf.set_mode, mode, shf_ids)))
+        return writes + gates
+
+    def commit(self):
+        """Apply the targets; the shadow follows every successful write"""
+        logger = logging.getLogger(__name__)
+        shadow = self.bench.shadow
+        writes = self.plan()
+        logger.debug(f"Path transaction: {len(writes)} writes")
+        for keys, applied, call in writes:
+            for key in keys:
+                shadow.pop(key, None)
+            logger.debug(f"{call.func.__name__}{call.args}")
+            call()
+            shadow.update(applied)
+        self.paths, self.lo_dsa, self.modes = {}, {}, {}
+
+
+class BenchSession:
+    """SHF, Mixer, LO and QsrMfg handles shared by the tx_setup helpers
+
+    Each handle is created on first use and reused by every later call, so
+    scripts calling the helpers in loops pay the setup cost once.
+
+    Usage:
+        with BenchSession() as bench:
+            bench.set_lo(lo_freq)
+            bench.tx_set_ch(shf_id, path)
+    """
+
+    def __init__(self, armada_ip: str = DEFAULT_ARMADA_IP):
+        self.armada_ip = armada_ip
+        self._shf: Optional[SHF] = None
+        self._mixer: Optional[Mixer] = None
+        self._lo: Optional[LO] = None
+        self._qsr: Optional[qsr_mfg.QsrMfg] = None
+        # last value written through transactions, see PathTransaction
+        self.shadow: Dict[tuple, object] = {}
+
+    def __enter__(self) -> "BenchSession":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Drop the handles; they are created again if used afterwards"""
+        self._shf = self._mixer = self._lo = self._qsr = None
+        self.forget_paths()
+
+    def forget_paths(self):
+        """Clear the shadow state; needed after writing to self.shf/self.mixer
+        directly, so the next transaction writes every setting"""
+        self.shadow.clear()
+
+    def transaction(self) -> PathTransaction:
+        """New PathTransaction on this session's shadow state"""
+        return PathTransaction(self)
+
+    @property
+    def shf(self) -> SHF:
+        if self._shf is None:
+            self._shf = SHF(self.armada_ip)
+        return self._shf
+
+    @property
+    def mixer(self) -> Mixer:
+        if self._mixer is None:
+            self._mixer = Mixer(self.armada_ip)
+        return self._mixer
+
+    @property
+    def lo(self) -> LO:
+        if self._lo is None:
+            self._lo = LO(self.armada_ip)
+        return self._lo
+
+    @property
+    def qsr(self) -> qsr_mfg.QsrMfg:
+        if self._qsr is None:
+            self._qsr = qsr_mfg.QsrMfg()
+        return self._qsr
+
+    def tx_set_ch(
+        self,
+        shf_id: int,
+        path: int,
+        if_atten_db: float = 10,
+        mixer_atten1: int = 10,
+        mixer_atten2: int = 0,
+        gate_dac: float = 0.8,
+    ):
+        # set the modem to send packets
+        self.qsr.transmit()
+
+        with self.transaction() as trans:
+            # set the LO DSA in the given path
+            # 10 db works for most of the frequencies/paths
+            # might need to be individually adjusted for each case
+            trans.set_lo_atten(shf_id, 10)
+            # IF DSA on the RF board, mixer and fem bias
+            trans.set_path(
+                shf_id,
+                path,
+                if_atten_db=if_atten_db,
+                mixer_enabled=True,
+                mixer_atten1=mixer_atten1,
+                mixer_atten2=mixer_atten2,
+                gate_dac=gate_dac,
+            )
+            trans.set_mode(shf_id, "tx")
+
+    def get_pd_cw(self, shf_id, path):
+        # trf.if_cpld.write_register(5,0,True)
+        r = self.shf.get_rf_sim_adc_voltages(shf_id, path, True)
+        # print("power det ", r)
+
+        if_av = r.if_vdet
+        rf0_av = r.rf_0
+        rf1_av = r.rf_1
+        return [if_av, rf0_av, rf1_av]
+
+    def set_lo(self, lo_freq, lo_dsa=10):
+        # sets the frequency on the synth
+        # sets the attenuation on the LO distribution
+        # in the RF board
+        self.lo.set_frequency_ghz(lo_freq)
+        return None
+
+    def set_all_off(self, shf_id):
+        # turns off all paths
+        #
+        # disables IF bgus
+        # disables mixer
+        # Set the gate to -5 V
+        # all DSA for max values
+        # set the modem to stop sending packets
+        self.qsr.set_test_mode()
+
+        with self.transaction() as trans:
+            # set LO DSA to 31 dB
+            trans.set_lo_atten(shf_id, 31)
+            for path in [0, 1, 2, 3]:
+                trans.set_path(shf_id, path, PATH_OFF)
+            trans.set_mode(shf_id, "tx")
+
+        print("all paths are turned off")
+
+
+# Module-level helpers open their own handles on every call; use a BenchSession
+# in loops.
 
 
 def tx_set_ch(
@@ -14,89 +313,21 @@ def tx_set_ch(
     mixer_atten2: int = 0,
     gate_dac: float = 0.8,
 ):
-
-    trf = SHF("192.168.100.1")
-    tmix = Mixer("192.168.100.1")
-
-    # set the modem to send packets
-    tmod = qsr_mfg.QsrMfg()
-    tmod.set_test_mode()
-    tmod.send_test_packet()
-
-    # set the LO DSA in the given path
-    # 10 db works for most of the frequencies/paths
-    # might need to be individually adjusted for each case
-    trf.set_lo_attenuator(shf_id, 10)
-
-    # Set IF DSA on the RF board.
-    # print("IF attenuation = ", if_atten_db)
-    trf.set_rf_tx_attenuator(shf_id, path, if_atten_db, True)
-
-    # mixer
-    tmix.enable_mixer(shf_id, path)
-    tmix.set_tx_attenuator1(shf_id, path, mixer_atten1)
-    tmix.set_tx_attenuator2(shf_id, path, mixer_atten2)
-    trf.set_mode("rx", [shf_id])
-    time.sleep(0.4)
-    trf.set_mode("tx", [shf_id])
-
-    # fem bias
-    trf.set_rf_dac_voltage(shf_id, path, gate_dac)
+    BenchSession().tx_set_ch(
+        shf_id, path, if_atten_db, mixer_atten1, mixer_atten2, gate_dac
+    )
 
 
 def get_pd_cw(shf_id, path):
-    trf = SHF("192.168.100.1")
-    # trf.if_cpld.write_register(5,0,True)
-    r = trf.get_rf_sim_adc_voltages(shf_id, path, True)
-    # print("power det ", r)
-
-    if_av = r.if_vdet
-    rf0_av = r.rf_0
-    rf1_av = r.rf_1
-    return [if_av, rf0_av, rf1_av]
+    return BenchSession().get_pd_cw(shf_id, path)
 
 
 def set_lo(lo_freq, lo_dsa=10):
-    # sets the frequency on the synth
-    # sets the attenuation on the LO distribution
-    # in the RF board
-    tlo = LO("192.168.100.1")
-    tlo.set_frequency_ghz(lo_freq)
-    return None
+    return BenchSession().set_lo(lo_freq, lo_dsa)
 
 
 def set_all_off(shf_id):
-    # turns off all paths
-    #
-    # disables IF bgus
-    # disables mixer
-    # Set the gate to -5 V
-    # all DSA for max values
-    trf = SHF("192.168.100.1")
-    tmix = Mixer("192.168.100.1")
-
-    # set the modem to stop sending packets
-    tmod = qsr_mfg.QsrMfg()
-    tmod.set_test_mode()
-
-    # set LO DSA to 31 dB
-    trf.set_lo_attenuator(shf_id, 31)
-    for path in [0, 1, 2, 3]:
-        # Set IF DSA on the RF board.
-        trf.set_rf_tx_attenuator(shf_id, path, 31.5, True)
-
-        # mixer
-        tmix.disable_mixer(shf_id, path)
-        tmix.set_tx_attenuator1(shf_id, path, 15)
-        tmix.set_tx_attenuator2(shf_id, path, 15)
-        trf.set_mode("rx", [shf_id])
-        time.sleep(0.4)
-        trf.set_mode("tx", [shf_id])
-
-        # fem bias
-        trf.set_rf_dac_voltage(shf_id, path, 2.99)
-
-    print("all paths are turned off")
+    BenchSession().set_all_off(shf_id)
 
 
 def main():
@@ -105,16 +336,17 @@ def main():
     shf_id = int(shf_id)
     path_id = input("Path id [0,1,2,3] or off ")
 
-    if path_id in ["0", "1", "2", "3"]:
-        path_id = int(path_id)
-        print("setting up path: ", path_id)
-        lo_freq = float(input("LO frequency: [GHz] "))
-        # sets the LO frequency in the synth
-        set_lo(lo_freq)
-        tx_set_ch(shf_id, path_id)
+    with BenchSession() as bench:
+        if path_id in ["0", "1", "2", "3"]:
+            path_id = int(path_id)
+            print("setting up path: ", path_id)
+            lo_freq = float(input("LO frequency: [GHz] "))
+            # sets the LO frequency in the synth
+            bench.set_lo(lo_freq)
+            bench.tx_set_ch(shf_id, path_id)
 
-    if path_id == "off":
-        set_all_off(shf_id)
+        if path_id == "off":
+            bench.set_all_off(shf_id)
 
 
 if __name__ == "__main__":
@@ -1,12 +1,25 @@
 """Utils for titan24_prototypes"""
-import sys
+import os
+import copy
+import json
+import queue
+import atexit
+import pickle
 import logging
+import time
+import threading
+import subprocess
+import logging.handlers
 from pathlib import Path
 from logging import Logger
-from subprocess import check_output, CalledProcessError
+from typing import Any, Callable, Dict, Optional, Tuple
 
 try:
     import yaml
+
+    # libyaml bindings are several times faster than the pure-Python classes
+    YamlLoader = getattr(yaml, "CUnsafeLoader", yaml.UnsafeLoader)
+    YamlDumper = getattr(yaml, "CDumper", yaml.Dumper)
 except ModuleNotFoundError:
     print("Couldn't import yaml")
 
@@ -23,13 +36,107 @@ SUCCESS_LEVEL = 25
 
 def load_yaml(filename):
     with open(filename, "r") as ifile:
-        return yaml.load(ifile, Loader=yaml.UnsafeLoader)
+        return yaml.load(ifile, Loader=YamlLoader)
 
 
 def save_yaml(filename, data):
     Path(filename).parent.mkdir(parents=True, exist_ok=True)
     with open(filename, "w+") as outfile:
-        yaml.dump(data, outfile, default_flow_style=False, sort_keys=False)
+        yaml.dump(
+            data, outfile, Dumper=YamlDumper, default_flow_style=False, sort_keys=False
+        )
+
+
+class ConfigStore:
+    """Cache of parsed YAML files keyed by path and modification time
+
+    A file is parsed again only when its mtime or size changes. With snapshot
+    enabled the parsed document is also pickled next to the file
+    (<name>.pickle), so a fresh process skips parsing large calibration tables.
+    """
+
+    SNAPSHOT_SUFFIX = ".pickle"
+
+    def __init__(self):
+        self._cache: Dict[str, Tuple[Tuple[int, int], Any]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(filename: str) -> Tuple[int, int]:
+        stat = os.stat(filename)
+        return stat.st_mtime_ns, stat.st_size
+
+    def load(self, filename, snapshot: bool = False, copy_data: bool = False):
+        """Parsed contents of a YAML file
+
+        :param filename: YAML file
+        :param snapshot: read/write the pickled snapshot of the file
+        :param copy_data: return a deep copy; otherwise the cached document is
+            shared between callers and must not be modified
+        """
+        path = os.path.abspath(filename)
+        key = self._key(path)
+        with self._lock:
+            cached = self._cache.get(path)
+        if cached is not None and cached[0] == key:
+            data = cached[1]
+        else:
+            data = self._load_snapshot(path, key) if snapshot else None
+            if data is None:
+                data = load_yaml(path)
+                if snapshot:
+                    self._save_snapshot(path, key, data)
+            with self._lock:
+                self._cache[path] = (key, data)
+        return copy.deepcopy(data) if copy_data else data
+
+    def save(self, filename, data, snapshot: bool = False):
+        """save_yaml() and keep data as the cached contents of the file"""
+        save_yaml(filename, data)
+        path = os.path.abspath(filename)
+        key = self._key(path)
+        if snapshot:
+            self._save_snapshot(path, key, data)
+        with self._lock:
+            self._cache[path] = (key, data)
+
+    def invalidate(self, filename=None):
+        """Drop one file, or every file, from the in-memory cache"""
+        with self._lock:
+            if filename is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(os.path.abspath(filename), None)
+
+    def _load_snapshot(self, path: str, key: Tuple[int, int]):
+        try:
+            with open(path + self.SNAPSHOT_SUFFIX, "rb") as ifile:
+                snap_key, data = pickle.load(ifile)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            return None
+        return data if snap_key == key else None
+
+    def _save_snapshot(self, path: str, key: Tuple[int, int], data):
+        tmp_name = f"{path}{self.SNAPSHOT_SUFFIX}.{os.getpid()}"
+        try:
+            with open(tmp_name, "wb") as outfile:
+                pickle.dump((key, data), outfile, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_name, path + self.SNAPSHOT_SUFFIX)
+        except OSError as err:
+            logging.getLogger(__name__).warning(f"Couldn't write snapshot: {err}")
+
+
+CONFIG_STORE = ConfigStore()
+
+
+def load_config(filename, snapshot: bool = False, copy_data: bool = False):
+    """Cached load_yaml(); see ConfigStore.load"""
+    return CONFIG_STORE.load(filename, snapshot, copy_data)
+
+
+def save_config(filename, data, snapshot: bool = False):
+    """save_yaml() through the shared ConfigStore"""
+    CONFIG_STORE.save(filename, data, snapshot)
 
 
 def save_file(filename, data_str):
@@ -49,22 +156,63 @@ class ColorFormatter(logging.Formatter):
 
     def __init__(self, fmt="%(levelname)s: %(msg)s"):
         logging.Formatter.__init__(self, fmt)
+        # one formatter per level instead of swapping _style._fmt per record
+        self.debug_formatter = logging.Formatter(self.debug_fmt)
+        self.info_formatter = logging.Formatter(self.info_fmt)
+        self.success_formatter = logging.Formatter(self.success_fmt)
+        self.error_formatter = logging.Formatter(self.error_fmt)
+        self.warning_formatter = logging.Formatter(self.warning_fmt)
 
     def format(self, record):
-        format_orig = self._style._fmt
         if record.levelno <= logging.DEBUG:
-            self._style._fmt = self.debug_fmt
+            formatter = self.debug_formatter
         elif record.levelno == logging.INFO:
-            self._style._fmt = self.info_fmt
+            formatter = self.info_formatter
         elif record.levelno == SUCCESS_LEVEL:
-            self._style._fmt = self.success_fmt
+            formatter = self.success_formatter
         elif record.levelno == logging.ERROR:
-            self._style._fmt = self.error_fmt
+            formatter = self.error_formatter
         else:
-            self._style._fmt = self.warning_fmt
-        result = logging.Formatter.format(self, record)
-        self._style._fmt = format_orig
-        return result
+            formatter = self.warning_formatter
+        return formatter.format(record)
+
+
+# attribute carrying the fields of a measurement point, see log_measurement()
+MEASUREMENT_ATTR = "measurement"
+
+
+class JsonlFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message, measurement"""
+
+    def format(self, record):
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        measurement = getattr(record, MEASUREMENT_ATTR, None)
+        if measurement is not None:
+            entry[MEASUREMENT_ATTR] = measurement
+        return json.dumps(entry, default=str)
+
+
+class JsonlFilter(logging.Filter):
+    """Passes measurement points and records at SUCCESS level"""
+
+    def filter(self, record):
+        return (
+            record.levelno == SUCCESS_LEVEL
+            or getattr(record, MEASUREMENT_ATTR, None) is not None
+        )
+
+
+def log_measurement(logger: Logger, message: str, level=logging.DEBUG, **fields):
+    """Log a measurement point; fields are recorded in the JSONL run log
+
+    e.g. log_measurement(logger, "pout", channel=36, power_dbm=14.2, evm_db=-35)
+    """
+    logger.log(level, message, extra={MEASUREMENT_ATTR: fields})
 
 
 def add_logging_level(level_name: str, level_num: int, method_name: str = None) -> None:
@@ -105,19 +253,86 @@ def add_logging_level(level_name: str, level_num: int, method_name: str = None)
     setattr(logging, method_name, log_to_root)
 
 
-def wait_for_qtn() -> None:
-    # dont need the whole traceback, set level to 0 temporarily
-    sys.tracebacklimit = 0
-    try:
-        check_output("systemctl status qtn-config", shell=True)
-    except CalledProcessError:
+def poll_until(
+    probe: Callable[[], Any],
+    timeout: float,
+    initial_delay_s: float = 0.1,
+    factor: float = 2.0,
+    max_delay_s: float = 2.0,
+) -> Tuple[bool, int, Optional[str]]:
+    """Call probe until it returns truthy, backing off exponentially
+
+    Exceptions raised by probe count as a failed attempt. At least one attempt
+    is made even with timeout 0.
+
+    :return: (ready, attempts, last error message)
+    """
+    deadline = time.monotonic() + timeout
+    delay = initial_delay_s
+    attempts = 0
+    error = None
+    while True:
+        attempts += 1
+        try:
+            if probe():
+                return True, attempts, None
+            error = "not ready"
+        except Exception as err:  # pylint: disable=broad-except
+            error = f"{type(err).__name__}: {err}"
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False, attempts, error
+        time.sleep(min(delay, remaining))
+        delay = min(delay * factor, max_delay_s)
+
+
+def qtn_active() -> bool:
+    """True if the qtn-config service is active on this host"""
+    result = subprocess.run(
+        ["systemctl", "is-active", "--quiet", "qtn-config"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        check=False,
+    )
+    return result.returncode == 0
+
+
+def wait_for_qtn(timeout: float = 30) -> None:
+    """Wait until qtn-config is active
+
+    :param timeout: seconds to keep retrying; 0 checks once
+    :raises ConnectionError: if it is still not up after timeout
+    """
+    ready, attempts, error = poll_until(qtn_active, timeout)
+    if not ready:
         print("Qtn not up yet! Try again later.")
-        raise ConnectionError() from None
-    sys.tracebacklimit = 1000  # default is 1000
+        # dont need the whole traceback
+        raise ConnectionError(
+            f"qtn-config not active after {attempts} attempts: {error}"
+        ) from None
+
 
+_LOG_LISTENER: Optional[logging.handlers.QueueListener] = None
 
-def set_up_logging(debug=False) -> Logger:
-    """Set up the handlers for logging titan24_prototypes to stderr."""
+
+def stop_logging() -> None:
+    """Flush and stop the queued logging thread started by set_up_logging"""
+    global _LOG_LISTENER  # pylint: disable=global-statement
+    if _LOG_LISTENER is not None:
+        _LOG_LISTENER.stop()
+        _LOG_LISTENER = None
+
+
+def set_up_logging(debug=False, queued=True, jsonl_file=None) -> Logger:
+    """Set up the handlers for logging titan24_prototypes to stderr.
+
+    :param debug: also show DEBUG records on stderr
+    :param queued: format and write records in a background thread; logging
+        calls only put the record on a queue
+    :param jsonl_file: also write measurement points and SUCCESS records to
+        this file as JSON lines
+    """
+    global _LOG_LISTENER  # pylint: disable=global-statement
     logger = logging.getLogger()
     logger.setLevel(logging.DEBUG)
     stderr_handler = logging.StreamHandler()
@@ -127,7 +342,25 @@ def set_up_logging(debug=False) -> Logger:
         stderr_handler.setLevel(logging.DEBUG)
     else:
         stderr_handler.setLevel(logging.INFO)
-    logger.addHandler(stderr_handler)
+    handlers = [stderr_handler]
+    if jsonl_file is not None:
+        Path(jsonl_file).parent.mkdir(parents=True, exist_ok=True)
+        jsonl_handler = logging.FileHandler(jsonl_file)
+        jsonl_handler.setFormatter(JsonlFormatter())
+        jsonl_handler.addFilter(JsonlFilter())
+        handlers.append(jsonl_handler)
+    if queued:
+        stop_logging()
+        log_queue: queue.SimpleQueue = queue.SimpleQueue()
+        logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        _LOG_LISTENER = logging.handlers.QueueListener(
+            log_queue, *handlers, respect_handler_level=True
+        )
+        _LOG_LISTENER.start()
+        atexit.register(stop_logging)
+    else:
+        for handler in handlers:
+            logger.addHandler(handler)
 
     add_logging_level("SUCCESS", SUCCESS_LEVEL, method_name=None)
     return logger